@@ -0,0 +1,87 @@
+import argparse
+import asyncio
+
+import config
+from db import async_session
+from engines.compaction import compact_measure_data, retention_policy
+from engines.device_types import migrate_device_type_categories
+from engines.devices import rebuild_devices_latest_readings
+from engines.measure_data import migrate_measure_data_values
+from engines.rollups import rebuild_rollups
+
+
+async def rebuild_latest_readings(args: argparse.Namespace):
+    async with async_session() as session:
+        await rebuild_devices_latest_readings(session)
+
+
+async def rebuild_measure_data_rollups(args: argparse.Namespace):
+    async with async_session() as session:
+        await rebuild_rollups(session, device_id=args.device_id)
+
+
+async def migrate_measure_data(args: argparse.Namespace):
+    async with async_session() as session:
+        await migrate_measure_data_values(session, chunk_size=args.chunk_size)
+
+
+async def migrate_device_types(args: argparse.Namespace):
+    async with async_session() as session:
+        await migrate_device_type_categories(session)
+
+
+async def compact(args: argparse.Namespace):
+    async with async_session() as session:
+        report = await compact_measure_data(
+            session,
+            retention_policy,
+            chunk_size=config.COMPACTION_CHUNK_SIZE,
+            dry_run=args.dry_run,
+        )
+
+    action = "Would reclaim" if args.dry_run else "Reclaimed"
+    print(f"{action} {report.raw_rows} raw rows (~{report.raw_bytes} bytes)")
+    print(f"{action} {report.hourly_rollup_rows} hourly rollup rows (~{report.hourly_rollup_bytes} bytes)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser(
+        "rebuild-latest-readings",
+        help="Backfill device_latest_readings from measure_datas",
+    ).set_defaults(handler=rebuild_latest_readings)
+
+    rebuild_rollups_parser = subparsers.add_parser(
+        "rebuild-rollups",
+        help="Recompute hourly, daily and monthly rollups from measure_datas",
+    )
+    rebuild_rollups_parser.add_argument("--device-id", type=int, default=None)
+    rebuild_rollups_parser.set_defaults(handler=rebuild_measure_data_rollups)
+
+    migrate_parser = subparsers.add_parser(
+        "migrate-measure-data",
+        help="Add the numeric value column and time-series indexes to measure_datas and backfill it",
+    )
+    migrate_parser.add_argument("--chunk-size", type=int, default=10000)
+    migrate_parser.set_defaults(handler=migrate_measure_data)
+
+    subparsers.add_parser(
+        "migrate-device-types",
+        help="Add the device category column to device_types and derive it from the old name prefixes",
+    ).set_defaults(handler=migrate_device_types)
+
+    compact_parser = subparsers.add_parser(
+        "compact-measure-data",
+        help="Apply the raw data and hourly rollup retention policy",
+    )
+    compact_parser.add_argument("--dry-run", action="store_true")
+    compact_parser.set_defaults(handler=compact)
+
+    args = parser.parse_args()
+    asyncio.run(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()
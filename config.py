@@ -10,3 +10,59 @@ LOG_LEVEL = config("LOG_LEVEL", default="INFO")
 SQLALCHEMY_DATABASE_URI = config("SQLALCHEMY_DATABASE_URI", str)
 ELASTICSEARCH_URL = config("ELASTICSEARCH_URL", str)
 ELASTICSEARCH_API_KEY = config("ELASTICSEARCH_API_KEY", str)
+ELASTICSEARCH_INDEX_PREFIX = config("ELASTICSEARCH_INDEX_PREFIX", default="measure-data")
+ELASTICSEARCH_QUEUE_SIZE = config("ELASTICSEARCH_QUEUE_SIZE", cast=int, default=50000)
+ELASTICSEARCH_BULK_SIZE = config("ELASTICSEARCH_BULK_SIZE", cast=int, default=1000)
+ELASTICSEARCH_FLUSH_INTERVAL_MS = config("ELASTICSEARCH_FLUSH_INTERVAL_MS", cast=int, default=1000)
+ELASTICSEARCH_MAX_RETRIES = config("ELASTICSEARCH_MAX_RETRIES", cast=int, default=5)
+ELASTICSEARCH_RETRY_BACKOFF = config("ELASTICSEARCH_RETRY_BACKOFF", cast=float, default=0.5)
+
+MEASURE_DATA_BATCH_MAX_SIZE = config("MEASURE_DATA_BATCH_MAX_SIZE", cast=int, default=1000)
+
+INGEST_BUFFER_MAX_SIZE = config("INGEST_BUFFER_MAX_SIZE", cast=int, default=10000)
+INGEST_FLUSH_SIZE = config("INGEST_FLUSH_SIZE", cast=int, default=500)
+INGEST_FLUSH_INTERVAL_MS = config("INGEST_FLUSH_INTERVAL_MS", cast=int, default=200)
+INGEST_FLUSH_MAX_RETRIES = config("INGEST_FLUSH_MAX_RETRIES", cast=int, default=5)
+INGEST_FLUSH_RETRY_BACKOFF = config("INGEST_FLUSH_RETRY_BACKOFF", cast=float, default=0.5)
+
+DEVICE_TOKEN_SECRET_KEY = config("DEVICE_TOKEN_SECRET_KEY", default="secret_key")
+DEVICE_TOKEN_CACHE_SIZE = config("DEVICE_TOKEN_CACHE_SIZE", cast=int, default=10000)
+DEVICE_TOKEN_CACHE_TTL = config("DEVICE_TOKEN_CACHE_TTL", cast=float, default=300)
+
+MQTT_BROKER_URL = config("MQTT_BROKER_URL", default="mqtt://broker.hivemq.com:1883")
+# Lightbulb command topic, formatted with the device id
+MQTT_LIGHTBULB_DEVICE_TOPIC = config("MQTT_LIGHTBULB_DEVICE_TOPIC", default="hust-iot-lightbulbs/{device_id}")
+MQTT_PUBLISH_QUEUE_SIZE = config("MQTT_PUBLISH_QUEUE_SIZE", cast=int, default=1000)
+MQTT_RECONNECT_INTERVAL = config("MQTT_RECONNECT_INTERVAL", cast=float, default=1)
+MQTT_MAX_RECONNECT_INTERVAL = config("MQTT_MAX_RECONNECT_INTERVAL", cast=float, default=30)
+MQTT_INGEST_ENABLED = config("MQTT_INGEST_ENABLED", cast=bool, default=False)
+MQTT_INGEST_TOPIC = config("MQTT_INGEST_TOPIC", default="hust-iot/devices/+/measure-data")
+MQTT_INGEST_QUEUE_SIZE = config("MQTT_INGEST_QUEUE_SIZE", cast=int, default=1000)
+
+HEARTBEAT_FLUSH_INTERVAL = config("HEARTBEAT_FLUSH_INTERVAL", cast=float, default=5)
+
+PUBSUB_QUEUE_SIZE = config("PUBSUB_QUEUE_SIZE", cast=int, default=100)
+PUBSUB_KEEPALIVE_INTERVAL = config("PUBSUB_KEEPALIVE_INTERVAL", cast=float, default=15)
+
+PAGE_DEFAULT_LIMIT = config("PAGE_DEFAULT_LIMIT", cast=int, default=100)
+PAGE_MAX_LIMIT = config("PAGE_MAX_LIMIT", cast=int, default=1000)
+
+CATALOG_CACHE_SIZE = config("CATALOG_CACHE_SIZE", cast=int, default=1000)
+CATALOG_CACHE_TTL = config("CATALOG_CACHE_TTL", cast=float, default=30)
+
+HISTORY_CACHE_SIZE = config("HISTORY_CACHE_SIZE", cast=int, default=10000)
+HISTORY_CACHE_MAX_BYTES = config("HISTORY_CACHE_MAX_BYTES", cast=int, default=32 * 1024 * 1024)
+HISTORY_CACHE_OPEN_PERIOD_TTL = config("HISTORY_CACHE_OPEN_PERIOD_TTL", cast=float, default=30)
+HISTORY_CACHE_CLOSED_PERIOD_TTL = config("HISTORY_CACHE_CLOSED_PERIOD_TTL", cast=float, default=3600)
+
+COMPACTION_ENABLED = config("COMPACTION_ENABLED", cast=bool, default=False)
+COMPACTION_INTERVAL = config("COMPACTION_INTERVAL", cast=float, default=3600)
+COMPACTION_CHUNK_SIZE = config("COMPACTION_CHUNK_SIZE", cast=int, default=5000)
+RAW_MEASURE_DATA_RETENTION_DAYS = config("RAW_MEASURE_DATA_RETENTION_DAYS", cast=int, default=30)
+HOURLY_ROLLUP_RETENTION_DAYS = config("HOURLY_ROLLUP_RETENTION_DAYS", cast=int, default=730)
+# Directory of the cold storage archive of compacted raw data, archiving is disabled when empty
+MEASURE_DATA_ARCHIVE_DIR = config("MEASURE_DATA_ARCHIVE_DIR", default="")
+
+METRICS_ENABLED = config("METRICS_ENABLED", cast=bool, default=True)
+# Requests running the same statement at least this many times are reported as N+1 queries
+METRICS_N_PLUS_ONE_THRESHOLD = config("METRICS_N_PLUS_ONE_THRESHOLD", cast=int, default=10)
@@ -1,4 +1,3 @@
-from sqlalchemy import select
 from typing import Annotated
 
 from fastapi import APIRouter, Depends
@@ -7,27 +6,25 @@ from starlette import status
 from starlette.responses import JSONResponse
 
 from db import get_session
+from engines.catalog import catalog_cache, get_device_type_rows
+from engines.pagination import PageParams, get_page_params
 from models.device_types import DeviceTypeModel
-from schemas.device_types import DeviceTypeSchema, CreateDeviceTypeSchema
+from schemas.base import PageSchema
+from schemas.device_types import DeviceTypeSchema, CreateDeviceTypeSchema, UpdateDeviceTypeSchema
 
 router = APIRouter(prefix="/device-types", tags=["device-types"])
 
 
 @router.get(
     "/",
-    response_model=list[DeviceTypeSchema],
+    response_model=PageSchema[DeviceTypeSchema],
 )
 async def get_device_types(
     session: Annotated[AsyncSession, Depends(get_session)],
+    page: Annotated[PageParams, Depends(get_page_params)],
 ):
-    stmt = select(DeviceTypeModel)
-
-    device_types = (await session.scalars(stmt)).all()
-
-    for _type in device_types:
-        _type.name = _type.name.replace("sensor_", "")
-
-    return device_types
+    device_types, next_cursor = await get_device_type_rows(session, page)
+    return {"items": device_types, "next_cursor": next_cursor}
 
 
 @router.post(
@@ -38,11 +35,11 @@ async def create_device_type(
     data: CreateDeviceTypeSchema,
     session: Annotated[AsyncSession, Depends(get_session)],
 ):
-    data.name = f"sensor_{data.name}"
     new_type = DeviceTypeModel(**data.dict())
 
     session.add(new_type)
     await session.commit()
+    catalog_cache.invalidate_device_types()
 
     return new_type
 
@@ -53,7 +50,7 @@ async def create_device_type(
 )
 async def update_device_type(
     device_type_id: int,
-    data: CreateDeviceTypeSchema,
+    data: UpdateDeviceTypeSchema,
     session: Annotated[AsyncSession, Depends(get_session)],
 ):
     device_type = await session.get(DeviceTypeModel, device_type_id)
@@ -62,11 +59,14 @@ async def update_device_type(
         return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"detail": "Device type not found"})
 
     if data.name:
-        device_type.name = f"sensor_{data.name}"
+        device_type.name = data.name
+    if data.category:
+        device_type.category = data.category
     if data.unit:
         device_type.unit = data.unit
 
     await session.commit()
+    catalog_cache.invalidate_device_types()
 
     return device_type
 
@@ -1,23 +1,27 @@
-import calendar
-import statistics
 from datetime import datetime
-from itertools import groupby
 from typing import Annotated
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from fastapi.encoders import jsonable_encoder
-from asyncio_mqtt import Client
-from sqlalchemy import select, func
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import func
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 from starlette import status
-from starlette.responses import JSONResponse
-
-from db import get_session
-from engines.devices import get_device_latest_measure_data, get_device_id_by_access_token
-from enums import DeviceDataGroupBy, DeviceTriggerAction
+from starlette.responses import JSONResponse, StreamingResponse
+
+from db import get_session, release_session
+from engines.catalog import catalog_cache, get_sensor_device_rows, get_lightbulb_device_rows
+from engines.devices import get_device_latest_measure_data, get_devices_latest_values, \
+    verify_device_access_token, invalidate_device_access_tokens
+from engines.device_tokens import device_token_issuer
+from engines.heartbeats import heartbeat_recorder
+from engines.history import GROUP_BY_TO_TIME_UNIT, get_device_history_values
+from engines.measure_data import export_measure_data, to_local_naive
+from engines.lightbulbs import switch_lightbulbs
+from engines.pagination import PageParams, get_page_params
+from enums import DeviceDataGroupBy, DeviceTriggerAction, MeasureDataExportFormat, DeviceHistoryStatistic
 from models.devices import DeviceModel
-from models.measure_data import MeasureDataModel
+from schemas.base import PageSchema
 from schemas.devices import DeviceSchema, DeviceHistorySchema, CreateDeviceSchema, UpdateDeviceSchema, PingDeviceSchema, \
     LightbulbDeviceSchema, TriggerActionSchema
 
@@ -26,60 +30,65 @@ router = APIRouter(prefix="/devices", tags=["devices"])
 
 @router.get(
     "",
-    response_model=list[DeviceSchema],
+    response_model=PageSchema[DeviceSchema],
+    response_class=ORJSONResponse,
 )
 async def get_devices_by_garden_id(
     session: Annotated[AsyncSession, Depends(get_session)],
+    page: Annotated[PageParams, Depends(get_page_params)],
     garden_id: int | None = None,
 ):
-    stmt = select(DeviceModel)
-    if garden_id is not None:
-        stmt = stmt.where(DeviceModel.garden_id == garden_id)
-
-    stmt = stmt.options(selectinload(DeviceModel.device_type_model))
-
-    devices = (await session.scalars(stmt)).all()
-
-    sensor_devices = [device for device in devices if device.device_type.startswith('sensor_')]
+    rows, next_cursor = await get_sensor_device_rows(session, page, garden_id)
+    values = await get_devices_latest_values(session, [row[0] for row in rows])
 
-    response = []
-    for device in sensor_devices:
-        response.append({
-            **device.__dict__,
-            "device_type": device.device_type,
-            "access_token": device.access_token,
-            'latest_measure_data': await get_device_latest_measure_data(session, device),
-        })
+    # Rows are built from plain columns and encoded by orjson, skipping the response_model validation
+    items = [
+        {
+            "id": device_id,
+            "title": title,
+            "description": description,
+            "device_type_id": device_type_id,
+            "device_type": device_type,
+            "status": device_status,
+            "access_token": device_token_issuer.issue(device_id),
+            "last_ping": heartbeat_recorder.get_last_ping(device_id, last_ping),
+            "latest_measure_data": f"{values[device_id]}{unit}" if device_id in values else "No data",
+        }
+        for device_id, title, description, device_type_id, device_type, device_status, last_ping, unit in rows
+    ]
 
-    return response
+    return ORJSONResponse({"items": items, "next_cursor": next_cursor})
 
 
 @router.get(
     "/lightbulbs",
-    response_model=list[LightbulbDeviceSchema],
+    response_model=PageSchema[LightbulbDeviceSchema],
+    response_class=ORJSONResponse,
 )
 async def get_lightbulb_devices(
     session: Annotated[AsyncSession, Depends(get_session)],
+    page: Annotated[PageParams, Depends(get_page_params)],
     garden_id: int | None = None,
 ):
-    stmt = select(DeviceModel)
-    if garden_id is not None:
-        stmt = stmt.where(DeviceModel.garden_id == garden_id)
-
-    stmt = stmt.options(selectinload(DeviceModel.device_type_model))
+    rows, next_cursor = await get_lightbulb_device_rows(session, page, garden_id)
 
-    devices = (await session.scalars(stmt)).all()
-
-    return [
+    items = [
         {
-            **device.__dict__,
-            "device_type": device.device_type,
-            "access_token": device.access_token,
-            "light_turned_on": device.light_turned_on,
+            "id": device_id,
+            "title": title,
+            "description": description,
+            "device_type_id": device_type_id,
+            "device_type": device_type,
+            "status": device_status,
+            "access_token": device_token_issuer.issue(device_id),
+            "last_ping": heartbeat_recorder.get_last_ping(device_id, last_ping),
+            "light_turned_on": bool((meta_data or {}).get("light_turned_on", False)),
         }
-        for device in devices if device.device_type.startswith('lightbulb')
+        for device_id, title, description, device_type_id, device_type, device_status, last_ping, meta_data in rows
     ]
 
+    return ORJSONResponse({"items": items, "next_cursor": next_cursor})
+
 
 @router.get(
     "/{device_id}",
@@ -101,7 +110,8 @@ async def get_device_by_id(
     return {
         **device.__dict__,
         "device_type": device.device_type,
-        "access_token": device.access_token,
+        "access_token": device_token_issuer.issue(device.id),
+        "last_ping": heartbeat_recorder.get_last_ping(device.id, device.last_ping),
         'latest_measure_data': await get_device_latest_measure_data(session, device)
     }
 
@@ -123,12 +133,12 @@ async def trigger_lightbulb(
         )
 
     light_turn_on = data.action == DeviceTriggerAction.TURN_ON
-    device.light_turned_on = light_turn_on
-    await session.commit()
 
-    # publish event
-    async with Client("broker.hivemq.com") as client:
-        await client.publish("hust-iot-lightbulbs", payload="1" if light_turn_on else "0")
+    async def set_state() -> list[int]:
+        device.light_turned_on = light_turn_on
+        return [device.id]
+
+    await switch_lightbulbs(session, device.garden_id, light_turn_on, set_state)
 
     return JSONResponse(
         status_code=status.HTTP_200_OK,
@@ -143,16 +153,14 @@ async def ping_device(
     data: PingDeviceSchema,
     session: Annotated[AsyncSession, Depends(get_session)],
 ):
-    device_id = get_device_id_by_access_token(data.access_token)
-    device: DeviceModel | None = await session.get(DeviceModel, device_id)
-    if not device:
+    device = await verify_device_access_token(session, data.access_token)
+    if not device or not device.exists:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
             content=jsonable_encoder({"detail": "Device not found"}),
         )
 
-    device.last_ping = datetime.now()
-    await session.commit()
+    heartbeat_recorder.record(device.device_id)
 
     return JSONResponse(
         status_code=status.HTTP_200_OK,
@@ -169,6 +177,7 @@ async def get_device_history(
     group_value: datetime,
     device_id: int,
     session: Annotated[AsyncSession, Depends(get_session)],
+    statistic: DeviceHistoryStatistic = DeviceHistoryStatistic.MEAN,
 ):
     device = await session.get(DeviceModel, device_id)
     if not device:
@@ -177,150 +186,55 @@ async def get_device_history(
             content=jsonable_encoder({"detail": "Device not found"}),
         )
 
-    if group_by == DeviceDataGroupBy.HOUR:
-        # Get the beginning of the day (midnight)
-        start_of_day = datetime.combine(group_value, datetime.min.time())
-        # Get the end of the day (23:59:59.999999)
-        end_of_day = datetime.combine(group_value, datetime.max.time())
-        selected_range = (start_of_day, end_of_day)
-    elif group_by == DeviceDataGroupBy.DAY:
-        # Get the first day of the month with beginning hour and minute
-        first_day = group_value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-
-        # Calculate the last day of the month
-        _, last_day_of_month = calendar.monthrange(group_value.year, group_value.month)
-        last_day = group_value.replace(day=last_day_of_month, hour=23, minute=59, second=59, microsecond=999999)
-
-        selected_range = (first_day, last_day)
-    elif group_by == DeviceDataGroupBy.MONTH:
-        # Get the first day of the year with beginning hour and minute
-        first_day = group_value.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-
-        # Calculate the last day of the year
-        last_day = group_value.replace(month=12, day=31, hour=23, minute=59, second=59, microsecond=999999)
-
-        selected_range = (first_day, last_day)
-    else:
-        return JSONResponse(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            content=jsonable_encoder({"detail": "Invalid group_by value"}),
-        )
-
-    stmt = (
-        select(MeasureDataModel)
-        .where(MeasureDataModel.device_id == device_id)
-        .where(MeasureDataModel.timestamp.between(*selected_range))
-        .order_by(MeasureDataModel.timestamp.asc())
-    )
-
-    def calculate_hourly_median(_data: list[MeasureDataModel]):
-        # Group data by hour
-        grouped_data = {hour: list(group) for hour, group in groupby(_data, key=lambda x: x.timestamp.hour)}
-
-        # Calculate median for each group
-        hourly_medians = {}
-        for hour, group in grouped_data.items():
-            values = [float(item.value) for item in group]
-            mean_value = statistics.mean(values)
-            hourly_medians[hour] = round(mean_value, 2)
-
-        full_hourly_medians = [
-            {
-                'timestamp': f"{hour}:00",
-                'value': hourly_medians[hour],
-            }
-            if hour in hourly_medians
-            else {
-                'timestamp': f"{hour}:00",
-                'value': "0.0",
-            }
-            for hour in range(24)
-        ]
-
-        return full_hourly_medians
-
-    def calculate_daily_median(_data: list[MeasureDataModel]):
-        # Group data by day
-        grouped_data = {day: list(group) for day, group in groupby(_data, key=lambda x: x.timestamp.day)}
-
-        # Get a list of days in the month
-        _, last_day_of_month = calendar.monthrange(group_value.year, group_value.month)
-        days_in_month = list(range(1, last_day_of_month + 1))
-
-
-        # Calculate median for each group
-        daily_medians = {}
-        for day, group in grouped_data.items():
-            values = [float(item.value) for item in group]
-            mean_value = statistics.mean(values)
-            daily_medians[day] = round(mean_value, 2)
-
-        full_daily_medians = [
-            {
-                'timestamp': f"{day}",
-                'value': daily_medians[day],
-            }
-            if day in daily_medians
-            else
-            {
-                'timestamp': f"{day}",
-                'value': "0.0",
-            }
-            for day in days_in_month
-        ]
-
-        return full_daily_medians
-
-    def calculate_monthly_median(_data: list[MeasureDataModel]):
-        # Group data by month
-        grouped_data = {month: list(group) for month, group in groupby(_data, key=lambda x: x.timestamp.month)}
-
-        # Calculate median for each group
-        monthly_medians = {}
-        for month, group in grouped_data.items():
-            values = [float(item.value) for item in group]
-            mean_value = statistics.mean(values)
-            monthly_medians[month] = round(mean_value, 2)
-
-        full_monthly_medians = [
-            {
-                'timestamp': f"{month}",
-                'value': monthly_medians[month],
-            }
-            if month in monthly_medians
-            else {
-                'timestamp': f"{month}",
-                'value': "0.0",
-            }
-            for month in range(1, 13)
-        ]
-
-        return full_monthly_medians
-
-    data = (await session.scalars(stmt)).all()
-
-    group_by_to_function = {
-        DeviceDataGroupBy.HOUR: calculate_hourly_median,
-        DeviceDataGroupBy.DAY: calculate_daily_median,
-        DeviceDataGroupBy.MONTH: calculate_monthly_median,
-    }
-
-    group_by_to_time_unit = {
-        DeviceDataGroupBy.HOUR: 'hour',
-        DeviceDataGroupBy.DAY: 'day',
-        DeviceDataGroupBy.MONTH: 'month',
-    }
-
     await session.refresh(device, ["device_type_model"])
     value_unit = device.device_type_model.unit
 
     return {
-        'time_unit': group_by_to_time_unit[group_by],
+        'time_unit': GROUP_BY_TO_TIME_UNIT[group_by],
         'value_unit': value_unit,
-        'values': group_by_to_function[group_by](list(data)),
+        'values': await get_device_history_values(session, device_id, group_by, group_value, statistic),
     }
 
 
+@router.get(
+    "/{device_id}/export",
+    description="Stream raw measure data of a device as NDJSON or CSV",
+)
+async def export_device_measure_data(
+    device_id: int,
+    start: datetime,
+    end: datetime,
+    session: Annotated[AsyncSession, Depends(get_session)],
+    export_format: MeasureDataExportFormat = Query(MeasureDataExportFormat.NDJSON, alias="format"),
+):
+    device = await session.get(DeviceModel, device_id)
+    if not device:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content=jsonable_encoder({"detail": "Device not found"}),
+        )
+
+    # Timestamps are stored as naive local datetimes, and aware ones can't be compared with naive ones
+    start, end = to_local_naive(start), to_local_naive(end)
+    if start > end:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content=jsonable_encoder({"detail": "start must be before end"}),
+        )
+
+    # The stream reads through its own session
+    await release_session(session)
+
+    media_type = "text/csv" if export_format == MeasureDataExportFormat.CSV else "application/x-ndjson"
+    filename = f"device-{device_id}-measure-data.{export_format.value}"
+
+    return StreamingResponse(
+        export_measure_data(device_id, start, end, export_format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @router.post(
     "",
     response_model=DeviceSchema,
@@ -334,11 +248,14 @@ async def create_device(
     session.add(device)
     await session.commit()
     await session.refresh(device, ["device_type_model"])
+    invalidate_device_access_tokens(device.id)
+    catalog_cache.invalidate_devices()
 
     return {
         **device.__dict__,
         "device_type": device.device_type,
-        "access_token": device.access_token,
+        "access_token": device_token_issuer.issue(device.id),
+        "last_ping": heartbeat_recorder.get_last_ping(device.id, device.last_ping),
         'latest_measure_data': await get_device_latest_measure_data(session, device)
     }
 
@@ -352,10 +269,27 @@ async def delete_device(
     device_id: int,
 ):
     device = await session.get(DeviceModel, device_id)
+    if not device:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content=jsonable_encoder({"detail": "Device not found"}),
+        )
+    # Built before deleting, while the device type and latest reading can still be read
+    await session.refresh(device, ["device_type_model"])
+    deleted_device = {
+        **device.__dict__,
+        "device_type": device.device_type,
+        "access_token": device_token_issuer.issue(device.id),
+        "last_ping": heartbeat_recorder.get_last_ping(device.id, device.last_ping),
+        'latest_measure_data': await get_device_latest_measure_data(session, device)
+    }
 
     await session.delete(device)
+    await session.commit()
+    invalidate_device_access_tokens(device_id)
+    catalog_cache.invalidate_devices()
 
-    return device
+    return deleted_device
 
 
 @router.put(
@@ -368,13 +302,12 @@ async def update_device(
     data: UpdateDeviceSchema,
 ):
     device: DeviceModel | None = await session.get(DeviceModel, device_id)
-    await session.refresh(device, ["device_type_model"])
-
     if not device:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
             content=jsonable_encoder({"detail": "Device not found"}),
         )
+    await session.refresh(device, ["device_type_model"])
 
     if data.title is not None:
         device.title = data.title
@@ -386,9 +319,13 @@ async def update_device(
         device.status = data.status
 
     await session.commit()
+    invalidate_device_access_tokens(device_id)
+    catalog_cache.invalidate_devices()
 
     return {
         **device.__dict__,
         "device_type": device.device_type,
+        "access_token": device_token_issuer.issue(device.id),
+        "last_ping": heartbeat_recorder.get_last_ping(device.id, device.last_ping),
         'latest_measure_data': await get_device_latest_measure_data(session, device)
     }
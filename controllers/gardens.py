@@ -1,16 +1,30 @@
+import asyncio
+from contextlib import suppress
+from datetime import datetime
 from typing import Annotated
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, WebSocket, WebSocketDisconnect
 from fastapi.encoders import jsonable_encoder
 from fastapi import Request
 from motor.core import AgnosticCollection
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
-from starlette.responses import JSONResponse
-
-from db import get_session
+from starlette.responses import JSONResponse, StreamingResponse
+
+import config
+from db import async_session, get_session, release_session
+from engines.catalog import catalog_cache, get_garden_rows
+from engines.devices import set_garden_lightbulbs_state
+from engines.history import GROUP_BY_TO_TIME_UNIT, get_devices_history_values
+from engines.pagination import PageParams, get_page_params
+from engines.lightbulbs import switch_lightbulbs
+from engines.pubsub import pubsub_hub, stream_garden_events
+from enums import DeviceCategory, DeviceDataGroupBy, DeviceHistoryStatistic, DeviceTriggerAction
+from models import DeviceModel, DeviceTypeModel
 from models.gardens import GardenModel
+from schemas.base import PageSchema
+from schemas.devices import GardenDeviceHistorySchema, BulkTriggerActionSchema, LightbulbStateSchema
 from schemas.gardens import CreateGardenSchema, GardenSchema, UpdateGardenSchema
 
 router = APIRouter(prefix="/gardens", tags=["gardens"])
@@ -18,14 +32,15 @@ router = APIRouter(prefix="/gardens", tags=["gardens"])
 
 @router.get(
     "/",
-    response_model=list[GardenSchema],
+    response_model=PageSchema[GardenSchema],
     response_description="Get all gardens"
 )
-async def get_gardens(session: Annotated[AsyncSession, Depends(get_session)]):
-    stmt = select(GardenModel)
-
-    gardens = (await session.scalars(stmt)).all()
-    return gardens
+async def get_gardens(
+    session: Annotated[AsyncSession, Depends(get_session)],
+    page: Annotated[PageParams, Depends(get_page_params)],
+):
+    gardens, next_cursor = await get_garden_rows(session, page)
+    return {"items": gardens, "next_cursor": next_cursor}
 
 
 @router.post(
@@ -41,6 +56,7 @@ async def create_garden(
     session.add(garden)
 
     await session.commit()
+    catalog_cache.invalidate_gardens()
 
     return garden
 
@@ -97,6 +113,130 @@ async def update_garden(
         garden.status = data.status
 
     await session.commit()
+    catalog_cache.invalidate_gardens()
 
     return garden
 
+
+@router.get(
+    "/{garden_id}/history",
+    response_model=list[GardenDeviceHistorySchema],
+    response_description="Get history of all (or the selected) sensor devices of a garden",
+)
+async def get_garden_history(
+    garden_id: int,
+    group_by: DeviceDataGroupBy,
+    group_value: datetime,
+    session: Annotated[AsyncSession, Depends(get_session)],
+    device_ids: list[int] | None = Query(None),
+    statistic: DeviceHistoryStatistic = DeviceHistoryStatistic.MEAN,
+):
+    garden = await session.get(GardenModel, garden_id)
+    if not garden:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content=jsonable_encoder({"detail": "Garden not found"}),
+        )
+
+    stmt = (
+        select(DeviceModel.id, DeviceTypeModel.unit)
+        .join(DeviceTypeModel, DeviceModel.device_type_id == DeviceTypeModel.id)
+        .where(DeviceModel.garden_id == garden_id)
+        .where(DeviceTypeModel.category == DeviceCategory.SENSOR)
+        .order_by(DeviceModel.id.asc())
+    )
+    if device_ids:
+        stmt = stmt.where(DeviceModel.id.in_(device_ids))
+
+    units = dict((await session.execute(stmt)).tuples().all())
+    values = await get_devices_history_values(session, list(units), group_by, group_value, statistic)
+
+    return [
+        {
+            'device_id': device_id,
+            'time_unit': GROUP_BY_TO_TIME_UNIT[group_by],
+            'value_unit': unit,
+            'values': values[device_id],
+        }
+        for device_id, unit in units.items()
+    ]
+
+
+@router.post(
+    "/{garden_id}/lightbulbs/trigger",
+    response_model=list[LightbulbStateSchema],
+    response_description="Turn on/off every (or the selected) lightbulb of a garden",
+)
+async def trigger_garden_lightbulbs(
+    garden_id: int,
+    data: BulkTriggerActionSchema,
+    session: Annotated[AsyncSession, Depends(get_session)],
+):
+    garden = await session.get(GardenModel, garden_id)
+    if not garden:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content=jsonable_encoder({"detail": "Garden not found"}),
+        )
+
+    light_turn_on = data.action == DeviceTriggerAction.TURN_ON
+
+    async def set_state() -> list[int]:
+        return await set_garden_lightbulbs_state(session, garden_id, light_turn_on, data.device_ids)
+
+    device_ids = await switch_lightbulbs(session, garden_id, light_turn_on, set_state)
+
+    return [{"device_id": device_id, "light_turned_on": light_turn_on} for device_id in device_ids]
+
+
+@router.get(
+    "/{garden_id}/events",
+    response_description="Stream new readings and lightbulb state changes of a garden as Server-Sent Events",
+)
+async def get_garden_events(
+    garden_id: int,
+    session: Annotated[AsyncSession, Depends(get_session)],
+):
+    garden = await session.get(GardenModel, garden_id)
+    if not garden:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content=jsonable_encoder({"detail": "Garden not found"}),
+        )
+
+    await release_session(session)
+
+    return StreamingResponse(
+        stream_garden_events(garden_id, config.PUBSUB_KEEPALIVE_INTERVAL),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/{garden_id}/ws")
+async def garden_events_websocket(
+    garden_id: int,
+    websocket: WebSocket,
+):
+    async with async_session() as session:
+        garden = await session.get(GardenModel, garden_id)
+    if not garden:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+
+    with pubsub_hub.subscribe(garden_id) as subscription:
+        async def forward():
+            async for event in subscription:
+                await websocket.send_json(event)
+
+        forward_task = asyncio.create_task(forward())
+        try:
+            # Nothing is expected from the client, only wait for it to go away
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+        finally:
+            forward_task.cancel()
+            with suppress(asyncio.CancelledError, WebSocketDisconnect):
+                await forward_task
@@ -1,17 +1,17 @@
 from datetime import datetime
 from typing import Annotated
 
-import jwt
 from fastapi import APIRouter, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 from starlette.responses import JSONResponse
 
 from db import get_session
-from engines.devices import get_device_id_by_access_token
-from models import DeviceModel
-from models.measure_data import MeasureDataModel
-from schemas.measure_data import MeasureDataSchema
+from engines.devices import verify_device_access_token, verify_device_access_tokens
+from engines.ingest import ingest_buffer, IngestBufferFull
+from engines.measure_data import save_measure_data, to_local_naive
+from engines.pubsub import publish_measure_data
+from schemas.measure_data import MeasureDataSchema, MeasureDataBatchSchema, MeasureDataBatchResultSchema
 
 router = APIRouter(prefix="/measure-data", tags=["measure-data"])
 
@@ -24,19 +24,73 @@ async def receive_new_measure_data(
     data: MeasureDataSchema,
     session: Annotated[AsyncSession, Depends(get_session)],
 ):
-    device_id = get_device_id_by_access_token(data.access_token)
-    device = await session.get(DeviceModel, device_id)
-    if not device:
+    device = await verify_device_access_token(session, data.access_token)
+    if not device or not device.exists:
         return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"detail": "Device not found"})
 
-    measure_data = MeasureDataModel(
-        device_id=device_id,
-        value=data.value,
-        timestamp=datetime.now(),
-    )
+    row = {
+        "device_id": device.device_id,
+        "value": data.value,
+        "timestamp": datetime.now(),
+    }
+    try:
+        ingest_buffer.put_nowait(row)
+    except IngestBufferFull:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"detail": "Ingest buffer is full, retry later"},
+            headers={"Retry-After": "1"},
+        )
 
-    session.add(measure_data)
-    await session.commit()
+    publish_measure_data(device.garden_id, device.device_id, data.value, row["timestamp"])
 
     return JSONResponse(status_code=status.HTTP_200_OK, content={"detail": "Data received successfully"})
 
+
+@router.post(
+    "/batch",
+    response_model=MeasureDataBatchResultSchema,
+    response_description="Receive a batch of data from one or many devices",
+)
+async def receive_measure_data_batch(
+    data: MeasureDataBatchSchema,
+    session: Annotated[AsyncSession, Depends(get_session)],
+):
+    devices = await verify_device_access_tokens(session, [item.access_token for item in data.items])
+
+    errors: dict[int, str] = {}
+    rows = []
+    garden_ids = []
+    for index, item in enumerate(data.items):
+        device = devices.get(item.access_token)
+        if not device:
+            errors[index] = "Invalid access token"
+            continue
+        if not device.exists:
+            errors[index] = "Device not found"
+            continue
+
+        rows.append({
+            "device_id": device.device_id,
+            "value": item.value,
+            "timestamp": to_local_naive(item.timestamp),
+        })
+        garden_ids.append(device.garden_id)
+
+    await save_measure_data(session, rows)
+
+    for garden_id, row in zip(garden_ids, rows):
+        publish_measure_data(garden_id, row["device_id"], row["value"], row["timestamp"])
+
+    return {
+        "received": len(rows),
+        "failed": len(errors),
+        "items": [
+            {
+                "index": index,
+                "success": index not in errors,
+                "detail": errors.get(index, "Data received successfully"),
+            }
+            for index in range(len(data.items))
+        ],
+    }
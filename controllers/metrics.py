@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+from starlette.responses import PlainTextResponse
+
+from engines.metrics import registry
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get(
+    "",
+    response_class=PlainTextResponse,
+    description="Metrics in the Prometheus text exposition format",
+)
+async def get_metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -1,9 +1,12 @@
 from fastapi import APIRouter
+
+import config
 from . import (
     devices,
     gardens,
     device_types,
-    measure_data
+    measure_data,
+    metrics,
 )
 
 
@@ -13,6 +16,8 @@ routers.include_router(devices.router, tags=["devices"])
 routers.include_router(gardens.router, tags=["gardens"])
 routers.include_router(device_types.router, tags=["device_types"])
 routers.include_router(measure_data.router, tags=["measure_data"])
+if config.METRICS_ENABLED:
+    routers.include_router(metrics.router, tags=["metrics"])
 
 
 
@@ -2,6 +2,7 @@ from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import DeclarativeMeta, declarative_base, sessionmaker, DeclarativeBase
 
 import config
+from engines.metrics import TimedAsyncAdaptedQueuePool
 
 
 class Base(DeclarativeBase):
@@ -9,6 +10,8 @@ class Base(DeclarativeBase):
 
 
 engine_configs = {"future": True, "pool_pre_ping": True}
+if config.METRICS_ENABLED:
+    engine_configs["poolclass"] = TimedAsyncAdaptedQueuePool
 
 async_session = sessionmaker(class_=AsyncSession, expire_on_commit=False)
 engine = create_async_engine(config.SQLALCHEMY_DATABASE_URI, **engine_configs)
@@ -22,3 +25,11 @@ async_session.configure(
 async def get_session() -> AsyncSession:
     async with async_session() as session:
         yield session
+
+
+async def release_session(session: AsyncSession):
+    """Give the connection of a request session back before a long streaming response.
+
+    The get_session dependency only closes it once the response is sent.
+    """
+    await session.close()
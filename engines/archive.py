@@ -0,0 +1,175 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+from models import MeasureDataModel
+
+# Timestamps are the naive local datetimes of measure_datas, as microseconds since 1970-01-01
+RECORD_DTYPE = np.dtype([("timestamp", "<i8"), ("value", "<f8")])
+
+
+def to_datetime64(timestamps: Sequence[datetime]) -> np.ndarray:
+    return np.array(timestamps, dtype="datetime64[us]")
+
+
+class MeasureDataArchive:
+    """Cold storage of numeric measure data.
+
+    Readings are stored per device and per month as packed
+    (timestamp, float64) records sorted by timestamp, and read back through
+    memory mapping so that slicing a month does not copy it.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def get_path(self, device_id: int, month: datetime) -> Path:
+        return self.root / str(device_id) / f"{month:%Y-%m}.bin"
+
+    def _load(self, path: Path) -> np.ndarray:
+        if not path.exists() or path.stat().st_size == 0:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        return np.memmap(path, dtype=RECORD_DTYPE, mode="r")
+
+    def _write(self, path: Path, records: np.ndarray, mode: str):
+        with open(path, mode) as file:
+            file.write(records.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+
+    def append(self, device_id: int, rows: Sequence[tuple[datetime, float]]) -> int:
+        """Archive readings of one device, returns how many were not archived yet.
+
+        Readings newer than the last archived one of their month are appended.
+        Late or out of order readings are merged into the month file, which is
+        rewritten sorted through a temporary file. Readings already archived
+        (same timestamp and value) are skipped, so archiving the same rows
+        twice is harmless.
+
+        Blocking; call it through asyncio.to_thread from the event loop.
+        """
+        appended = 0
+        months: dict[tuple[int, int], list[tuple[datetime, float]]] = {}
+        for timestamp, value in rows:
+            months.setdefault((timestamp.year, timestamp.month), []).append((timestamp, value))
+
+        for (year, month), month_rows in months.items():
+            path = self.get_path(device_id, datetime(year, month, 1))
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+            records = np.empty(len(month_rows), dtype=RECORD_DTYPE)
+            records["timestamp"] = to_datetime64([timestamp for timestamp, _ in month_rows]).astype("<i8")
+            records["value"] = [value for _, value in month_rows]
+            # Sorted by (timestamp, value) without duplicates
+            records = np.unique(records)
+
+            existing = self._load(path)
+            if not len(existing) or records["timestamp"][0] > existing["timestamp"][-1]:
+                del existing
+                self._write(path, records, "ab")
+                appended += len(records)
+                continue
+
+            merged = np.unique(np.concatenate([np.asarray(existing), records]))
+            new_count = len(merged) - len(existing)
+            del existing
+            if new_count:
+                temporary_path = path.with_suffix(".tmp")
+                self._write(temporary_path, merged, "wb")
+                os.replace(temporary_path, path)
+            appended += new_count
+
+        return appended
+
+    def read(self, device_id: int, start: datetime, end: datetime) -> tuple[np.ndarray, np.ndarray]:
+        """Timestamps (datetime64[us]) and values of a device archived readings in [start, end].
+
+        Blocking; call it through asyncio.to_thread from the event loop.
+        """
+        first, last = to_datetime64([start, end]).astype("<i8")
+
+        chunks = []
+        month = start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        while month <= end:
+            records = self._load(self.get_path(device_id, month))
+            lower = np.searchsorted(records["timestamp"], first, side="left")
+            upper = np.searchsorted(records["timestamp"], last, side="right")
+            if upper > lower:
+                chunks.append(records[lower:upper])
+            month = (month + timedelta(days=32)).replace(day=1)
+
+        if not chunks:
+            return np.empty(0, dtype="datetime64[us]"), np.empty(0, dtype="<f8")
+
+        records = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+        return records["timestamp"].view("datetime64[us]"), records["value"]
+
+
+measure_data_archive = MeasureDataArchive(config.MEASURE_DATA_ARCHIVE_DIR) if config.MEASURE_DATA_ARCHIVE_DIR else None
+
+
+def _read_devices(
+    device_ids: Sequence[int],
+    start: datetime,
+    end: datetime,
+) -> dict[int, tuple[np.ndarray, np.ndarray]]:
+    return {device_id: measure_data_archive.read(device_id, start, end) for device_id in device_ids}
+
+
+async def load_devices_series(
+    session: AsyncSession,
+    device_ids: Sequence[int],
+    start: datetime,
+    end: datetime,
+) -> dict[int, tuple[np.ndarray, np.ndarray]]:
+    """Numeric readings of each device in [start, end], from the archive and from measure_datas.
+
+    The live readings of all devices come from one query, turned into column
+    arrays and sliced per device, and the archive is read off the event loop.
+    """
+    stmt = (
+        select(MeasureDataModel.device_id, MeasureDataModel.timestamp, MeasureDataModel.numeric_value)
+        .where(MeasureDataModel.device_id.in_(set(device_ids)))
+        .where(MeasureDataModel.timestamp.between(start, end))
+        .where(MeasureDataModel.numeric_value.is_not(None))
+        .order_by(MeasureDataModel.device_id.asc(), MeasureDataModel.timestamp.asc())
+    )
+    columns = list(zip(*(await session.execute(stmt)).all())) or [(), (), ()]
+    live_device_ids = np.array(columns[0], dtype="<i8")
+    live_timestamps = to_datetime64(columns[1])
+    live_values = np.array(columns[2], dtype="<f8")
+
+    archived = {}
+    if measure_data_archive is not None:
+        archived = await asyncio.to_thread(_read_devices, device_ids, start, end)
+
+    series = {}
+    for device_id in device_ids:
+        # Rows are ordered by device, so each device's readings are a slice
+        lower, upper = np.searchsorted(live_device_ids, [device_id, device_id + 1])
+        device_timestamps, device_values = live_timestamps[lower:upper], live_values[lower:upper]
+
+        archived_timestamps, archived_values = archived.get(device_id, (device_timestamps[:0], device_values[:0]))
+        if not len(archived_timestamps):
+            series[device_id] = device_timestamps, device_values
+            continue
+        if not len(device_timestamps):
+            series[device_id] = archived_timestamps, archived_values
+            continue
+
+        # The day being compacted may be in both for a moment, and a late reading may land in an archived
+        # day, so merge both sources by (timestamp, value) rather than splitting them at a timestamp
+        records = np.empty(len(archived_timestamps) + len(device_timestamps), dtype=RECORD_DTYPE)
+        records["timestamp"] = np.concatenate([archived_timestamps, device_timestamps]).astype("<i8")
+        records["value"] = np.concatenate([archived_values, device_values])
+        records = np.unique(records)
+        series[device_id] = records["timestamp"].view("datetime64[us]"), records["value"]
+
+    return series
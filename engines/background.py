@@ -0,0 +1,46 @@
+import asyncio
+from abc import ABC, abstractmethod
+from contextlib import suppress
+from typing import Awaitable
+
+
+class BackgroundService(ABC):
+    """Runs `_run` in a background task between `start` and `stop`.
+
+    Work that must not be cut short by `stop`, like a write that is half
+    done, goes through `_shielded`: cancelling the task then lets it finish,
+    and `stop` waits for it.
+    """
+
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+        self._inflight: asyncio.Future | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+        # Work that was running when we got cancelled keeps going thanks to the shield
+        if self._inflight is not None and not self._inflight.done():
+            await self._inflight
+
+    async def _shielded(self, work: Awaitable):
+        self._inflight = asyncio.ensure_future(work)
+        await asyncio.shield(self._inflight)
+
+    @abstractmethod
+    async def _run(self):
+        """Body of the background task, cancelled by `stop`"""
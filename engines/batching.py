@@ -0,0 +1,106 @@
+import asyncio
+from abc import abstractmethod
+
+from loguru import logger
+
+from engines.background import BackgroundService
+
+MAX_RETRY_BACKOFF = 30
+
+
+class BatchWorker(BackgroundService):
+    """Bounded in-memory queue drained by a background task.
+
+    Items are handed to `_flush` in batches whenever `flush_size` items are
+    waiting or `flush_interval` seconds have passed since the first item of
+    the batch, whichever comes first. Subclasses implement `_flush`.
+
+    A batch that raises, or the part of it that `_flush` returns, is retried
+    up to `max_retries` times with exponential backoff; what is left after
+    that is counted in `dropped`, so the worker keeps running. While a batch
+    is being retried no new batch is flushed and the queue fills up.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        flush_size: int,
+        flush_interval: float,
+        max_retries: int = 0,
+        retry_backoff: float = 0,
+    ):
+        super().__init__()
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.dropped = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._pending: list = []
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        await super().stop()
+
+        items, self._pending = self._pending, []
+        while not self._queue.empty():
+            items.append(self._queue.get_nowait())
+
+        for i in range(0, len(items), self.flush_size):
+            await self._safe_flush(items[i:i + self.flush_size])
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+
+        self._pending.append(await self._queue.get())
+        deadline = loop.time() + self.flush_interval
+
+        while len(self._pending) < self.flush_size:
+            try:
+                self._pending.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+
+            try:
+                self._pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _run(self):
+        while True:
+            await self._collect()
+
+            items, self._pending = self._pending, []
+            await self._shielded(self._safe_flush(items))
+
+    async def _safe_flush(self, items: list):
+        name = type(self).__name__
+
+        for attempt in range(self.max_retries + 1):
+            if not items:
+                return
+            if attempt:
+                await asyncio.sleep(min(self.retry_backoff * 2 ** (attempt - 1), MAX_RETRY_BACKOFF))
+
+            try:
+                items = await self._flush(items) or []
+            except Exception:
+                logger.exception(f"{name} failed to flush {len(items)} items (attempt {attempt + 1})")
+
+        if items:
+            self.dropped += len(items)
+            logger.error(f"{name} dropping {len(items)} items after {self.max_retries + 1} flush attempts")
+
+    @abstractmethod
+    async def _flush(self, items: list) -> list | None:
+        """Handle one batch of queued items, returning the ones worth trying again"""
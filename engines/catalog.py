@@ -0,0 +1,133 @@
+from typing import Any, Awaitable, Callable, Hashable
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+from engines.cache import LRUCache
+from engines.pagination import PageParams, get_page, paginate
+from enums import DeviceCategory
+from models import DeviceModel, DeviceTypeModel, GardenModel
+
+_MISSING = object()
+
+
+class CatalogCache:
+    """Read-through cache of the device catalog: gardens, device types and devices.
+
+    Every part has its own sub-cache, keyed by the requested page, so a write
+    only drops the part it changed. Values are plain rows rather than ORM instances, so they can be
+    shared between sessions.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.gardens = LRUCache(max_size=max_size, ttl=ttl)
+        self.device_types = LRUCache(max_size=max_size, ttl=ttl)
+        self.devices = LRUCache(max_size=max_size, ttl=ttl)
+
+    @staticmethod
+    async def get(cache: LRUCache, key: Hashable, load: Callable[[], Awaitable[Any]]) -> Any:
+        value = cache.get(key, _MISSING)
+        if value is _MISSING:
+            value = await load()
+            cache.set(key, value)
+
+        return value
+
+    def invalidate_gardens(self):
+        self.gardens.clear()
+
+    def invalidate_device_types(self):
+        self.device_types.clear()
+        # Device rows carry the name and unit of their type
+        self.devices.clear()
+
+    def invalidate_devices(self):
+        self.devices.clear()
+
+
+catalog_cache = CatalogCache(max_size=config.CATALOG_CACHE_SIZE, ttl=config.CATALOG_CACHE_TTL)
+
+
+async def get_garden_rows(session: AsyncSession, page: PageParams) -> tuple[list[dict], str | None]:
+    async def load():
+        stmt = select(
+            GardenModel.id,
+            GardenModel.title,
+            GardenModel.address,
+            GardenModel.description,
+            GardenModel.status,
+        )
+        rows = (await session.execute(paginate(stmt, GardenModel.id, page))).all()
+        return get_page([row._asdict() for row in rows], page.limit, get_id=lambda row: row["id"])
+
+    return await catalog_cache.get(catalog_cache.gardens, page, load)
+
+
+async def get_device_type_rows(session: AsyncSession, page: PageParams) -> tuple[list[dict], str | None]:
+    async def load():
+        stmt = select(DeviceTypeModel.id, DeviceTypeModel.name, DeviceTypeModel.category, DeviceTypeModel.unit)
+        rows = (await session.execute(paginate(stmt, DeviceTypeModel.id, page))).all()
+        return get_page([row._asdict() for row in rows], page.limit, get_id=lambda row: row["id"])
+
+    return await catalog_cache.get(catalog_cache.device_types, page, load)
+
+
+async def get_sensor_device_rows(
+    session: AsyncSession,
+    page: PageParams,
+    garden_id: int | None = None,
+) -> tuple[list[tuple], str | None]:
+    """(id, title, description, device_type_id, device_type, status, last_ping, unit) of sensor devices"""
+    async def load():
+        stmt = (
+            select(
+                DeviceModel.id,
+                DeviceModel.title,
+                DeviceModel.description,
+                DeviceModel.device_type_id,
+                DeviceTypeModel.name,
+                DeviceModel.status,
+                DeviceModel.last_ping,
+                DeviceTypeModel.unit,
+            )
+            .join(DeviceModel.device_type_model)
+            .where(DeviceTypeModel.category == DeviceCategory.SENSOR)
+        )
+        if garden_id is not None:
+            stmt = stmt.where(DeviceModel.garden_id == garden_id)
+
+        rows = (await session.execute(paginate(stmt, DeviceModel.id, page))).tuples().all()
+        return get_page(rows, page.limit)
+
+    return await catalog_cache.get(catalog_cache.devices, (DeviceCategory.SENSOR, garden_id, page), load)
+
+
+async def get_lightbulb_device_rows(
+    session: AsyncSession,
+    page: PageParams,
+    garden_id: int | None = None,
+) -> tuple[list[tuple], str | None]:
+    """(id, title, description, device_type_id, device_type, status, last_ping, meta_data) of lightbulbs"""
+    async def load():
+        stmt = (
+            select(
+                DeviceModel.id,
+                DeviceModel.title,
+                DeviceModel.description,
+                DeviceModel.device_type_id,
+                DeviceTypeModel.name,
+                DeviceModel.status,
+                DeviceModel.last_ping,
+                DeviceModel.meta_data,
+            )
+            .join(DeviceModel.device_type_model)
+            .where(DeviceTypeModel.category == DeviceCategory.LIGHTBULB)
+        )
+        if garden_id is not None:
+            stmt = stmt.where(DeviceModel.garden_id == garden_id)
+
+        rows = (await session.execute(paginate(stmt, DeviceModel.id, page))).tuples().all()
+        return get_page(rows, page.limit)
+
+    return await catalog_cache.get(catalog_cache.devices, (DeviceCategory.LIGHTBULB, garden_id, page), load)
@@ -0,0 +1,231 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from loguru import logger
+from sqlalchemy import select, delete, func, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+from db import async_session
+from engines.archive import measure_data_archive
+from engines.background import BackgroundService
+from engines.rollups import get_bucket, rebuild_day_rollups, rebuild_month_rollups
+from enums import DeviceDataGroupBy
+from models import MeasureDataModel, MeasureDataRollupModel
+
+
+@dataclass
+class RetentionPolicy:
+    raw_days: int
+    hourly_rollup_days: int
+
+    def get_cutoffs(self, now: datetime) -> tuple[datetime, datetime]:
+        """Day aligned cutoffs before which raw data and hourly rollups are dropped"""
+        today = get_bucket(DeviceDataGroupBy.DAY, now)
+        return today - timedelta(days=self.raw_days), today - timedelta(days=self.hourly_rollup_days)
+
+
+@dataclass
+class CompactionReport:
+    raw_rows: int = 0
+    raw_bytes: int = 0
+    hourly_rollup_rows: int = 0
+    hourly_rollup_bytes: int = 0
+
+
+async def _get_average_row_size(session: AsyncSession, table_name: str) -> float:
+    stmt = text(
+        "SELECT (data_length + index_length) / GREATEST(table_rows, 1) "
+        "FROM information_schema.tables "
+        "WHERE table_schema = DATABASE() AND table_name = :table_name"
+    )
+    return float((await session.execute(stmt, {"table_name": table_name})).scalar() or 0)
+
+
+async def estimate_compaction(
+    session: AsyncSession,
+    policy: RetentionPolicy,
+    now: datetime,
+) -> CompactionReport:
+    raw_cutoff, hourly_cutoff = policy.get_cutoffs(now)
+
+    raw_rows = (await session.execute(
+        select(func.count()).select_from(MeasureDataModel).where(MeasureDataModel.timestamp < raw_cutoff)
+    )).scalar()
+    hourly_rollup_rows = (await session.execute(
+        select(func.count())
+        .select_from(MeasureDataRollupModel)
+        .where(MeasureDataRollupModel.granularity == DeviceDataGroupBy.HOUR.value)
+        .where(MeasureDataRollupModel.bucket < hourly_cutoff)
+    )).scalar()
+
+    return CompactionReport(
+        raw_rows=raw_rows,
+        raw_bytes=int(raw_rows * await _get_average_row_size(session, MeasureDataModel.__tablename__)),
+        hourly_rollup_rows=hourly_rollup_rows,
+        hourly_rollup_bytes=int(
+            hourly_rollup_rows * await _get_average_row_size(session, MeasureDataRollupModel.__tablename__)
+        ),
+    )
+
+
+async def _archive_raw_day(
+    session: AsyncSession,
+    day: datetime,
+):
+    """Copy the numeric raw data of one day to the cold storage archive, one device at a time"""
+    in_day = (MeasureDataModel.timestamp >= day) & (MeasureDataModel.timestamp < day + timedelta(days=1))
+
+    device_ids = (await session.scalars(
+        select(MeasureDataModel.device_id).where(in_day).distinct()
+    )).all()
+    for device_id in device_ids:
+        rows = (await session.execute(
+            select(MeasureDataModel.timestamp, MeasureDataModel.numeric_value)
+            .where(MeasureDataModel.device_id == device_id)
+            .where(in_day)
+            .where(MeasureDataModel.numeric_value.is_not(None))
+            .order_by(MeasureDataModel.timestamp.asc())
+        )).tuples().all()
+        await asyncio.to_thread(measure_data_archive.append, device_id, rows)
+
+
+async def _compact_raw_day(
+    session: AsyncSession,
+    day: datetime,
+    raw_cutoff: datetime,
+    chunk_size: int,
+) -> int:
+    """Bring the rollups of one day up to date with its raw data, archive it when
+    the archive is enabled, then delete that raw data chunk by chunk"""
+    await rebuild_day_rollups(session, day)
+    # Months that ended before the cutoff no longer receive readings, so their rollup can be derived safely
+    month = get_bucket(DeviceDataGroupBy.MONTH, day)
+    if (month + timedelta(days=32)).replace(day=1) <= raw_cutoff:
+        await rebuild_month_rollups(session, month)
+    await session.commit()
+
+    if measure_data_archive is not None:
+        await _archive_raw_day(session, day)
+
+    deleted = 0
+    while True:
+        ids = (await session.scalars(
+            select(MeasureDataModel.id)
+            .where(MeasureDataModel.timestamp >= day)
+            .where(MeasureDataModel.timestamp < day + timedelta(days=1))
+            .limit(chunk_size)
+        )).all()
+        if not ids:
+            return deleted
+
+        await session.execute(delete(MeasureDataModel).where(MeasureDataModel.id.in_(ids)))
+        await session.commit()
+        deleted += len(ids)
+
+
+async def _prune_hourly_rollups(
+    session: AsyncSession,
+    hourly_cutoff: datetime,
+    chunk_size: int,
+) -> int:
+    deleted = 0
+    while True:
+        keys = (await session.execute(
+            select(MeasureDataRollupModel.device_id, MeasureDataRollupModel.bucket)
+            .where(MeasureDataRollupModel.granularity == DeviceDataGroupBy.HOUR.value)
+            .where(MeasureDataRollupModel.bucket < hourly_cutoff)
+            .limit(chunk_size)
+        )).tuples().all()
+        if not keys:
+            return deleted
+
+        await session.execute(
+            delete(MeasureDataRollupModel)
+            .where(MeasureDataRollupModel.granularity == DeviceDataGroupBy.HOUR.value)
+            .where(tuple_(MeasureDataRollupModel.device_id, MeasureDataRollupModel.bucket).in_(keys))
+        )
+        await session.commit()
+        deleted += len(keys)
+
+
+async def compact_measure_data(
+    session: AsyncSession,
+    policy: RetentionPolicy,
+    chunk_size: int,
+    dry_run: bool = False,
+    now: datetime | None = None,
+) -> CompactionReport:
+    """Apply the retention policy to measure_datas and the hourly rollups.
+
+    Raw data is compacted one whole day at a time, oldest first: the day's
+    rollups are brought up to date with its raw rows, the numeric rows are
+    copied to the cold storage archive when MEASURE_DATA_ARCHIVE_DIR is set,
+    then the rows are deleted in chunks of `chunk_size`, each in its own
+    short transaction. With `dry_run`, only report how many rows and roughly
+    how many bytes would be reclaimed.
+    """
+    now = now or datetime.now()
+    if dry_run:
+        return await estimate_compaction(session, policy, now)
+
+    raw_cutoff, hourly_cutoff = policy.get_cutoffs(now)
+    report = CompactionReport()
+    raw_row_size = await _get_average_row_size(session, MeasureDataModel.__tablename__)
+    rollup_row_size = await _get_average_row_size(session, MeasureDataRollupModel.__tablename__)
+
+    while True:
+        # A seek on ix_measure_datas_timestamp, not a scan
+        oldest = (await session.execute(
+            select(func.min(MeasureDataModel.timestamp)).where(MeasureDataModel.timestamp < raw_cutoff)
+        )).scalar()
+        if oldest is None:
+            break
+
+        report.raw_rows += await _compact_raw_day(
+            session, get_bucket(DeviceDataGroupBy.DAY, oldest), raw_cutoff, chunk_size,
+        )
+
+    report.hourly_rollup_rows = await _prune_hourly_rollups(session, hourly_cutoff, chunk_size)
+    report.raw_bytes = int(report.raw_rows * raw_row_size)
+    report.hourly_rollup_bytes = int(report.hourly_rollup_rows * rollup_row_size)
+
+    return report
+
+
+class CompactionWorker(BackgroundService):
+    """Periodically apply the retention policy in the background.
+
+    Not shielded: compaction commits every chunk, so stopping in the
+    middle only leaves the rest for the next run.
+    """
+
+    def __init__(self, policy: RetentionPolicy, interval: float, chunk_size: int):
+        super().__init__()
+        self.policy = policy
+        self.interval = interval
+        self.chunk_size = chunk_size
+
+    async def _run(self):
+        while True:
+            try:
+                async with async_session() as session:
+                    report = await compact_measure_data(session, self.policy, self.chunk_size)
+                logger.info(f"Measure data compaction done: {report}")
+            except Exception:
+                logger.exception("Measure data compaction failed")
+
+            await asyncio.sleep(self.interval)
+
+
+retention_policy = RetentionPolicy(
+    raw_days=config.RAW_MEASURE_DATA_RETENTION_DAYS,
+    hourly_rollup_days=config.HOURLY_ROLLUP_RETENTION_DAYS,
+)
+
+compaction_worker = CompactionWorker(
+    policy=retention_policy,
+    interval=config.COMPACTION_INTERVAL,
+    chunk_size=config.COMPACTION_CHUNK_SIZE,
+)
@@ -0,0 +1,39 @@
+import jwt
+
+import config
+from engines.cache import LRUCache
+
+
+class DeviceTokenIssuer:
+    """Issues and decodes device access tokens.
+
+    A token only depends on the device id and the signing key, so each one is
+    encoded once and cached by device id. The key is read from the config at
+    startup; changing it takes a restart, which starts from an empty cache.
+    """
+
+    algorithm = "HS256"
+
+    def __init__(self, secret_key: str, max_size: int):
+        self.secret_key = secret_key
+        self.cache = LRUCache(max_size=max_size)
+
+    def issue(self, device_id: int) -> str:
+        access_token = self.cache.get(device_id)
+        if access_token is None:
+            access_token = jwt.encode({"device_id": device_id}, self.secret_key, algorithm=self.algorithm)
+            self.cache.set(device_id, access_token)
+
+        return access_token
+
+    def decode(self, access_token: str) -> int:
+        """Device id of an access token signed with the current key"""
+        decoded_token = jwt.decode(access_token, self.secret_key, algorithms=[self.algorithm])
+
+        return int(decoded_token.get("device_id"))
+
+
+device_token_issuer = DeviceTokenIssuer(
+    secret_key=config.DEVICE_TOKEN_SECRET_KEY,
+    max_size=config.DEVICE_TOKEN_CACHE_SIZE,
+)
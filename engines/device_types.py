@@ -0,0 +1,35 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+async def migrate_device_type_categories(session: AsyncSession):
+    """Add the indexed category column to device_types and derive it from the
+    name prefixes that were used to tell sensors and lightbulbs apart"""
+    connection = await session.connection()
+    columns = await connection.run_sync(
+        lambda sync_connection: {column["name"] for column in inspect(sync_connection).get_columns("device_types")}
+    )
+    if "category" in columns:
+        return
+
+    # Existing rows start out as actuators, so device types without a known prefix stay out of the sensor list
+    await session.execute(text(
+        "ALTER TABLE device_types "
+        "ADD COLUMN category VARCHAR(32) NOT NULL DEFAULT 'actuator' AFTER name, "
+        "ADD INDEX ix_device_types_category (category)"
+    ))
+    # Lightbulbs go first and each UPDATE only touches unclassified rows, so a sensor whose
+    # name is left starting with "lightbulb" once its prefix is stripped stays a sensor
+    await session.execute(text(
+        "UPDATE device_types SET category = 'lightbulb' "
+        "WHERE category = 'actuator' AND LEFT(name, 9) = 'lightbulb'"
+    ))
+    await session.execute(text(
+        "UPDATE device_types SET category = 'sensor', name = SUBSTRING(name, 8) "
+        "WHERE category = 'actuator' AND LEFT(name, 7) = 'sensor_'"
+    ))
+    # New rows default to sensor, like DeviceTypeModel
+    await session.execute(text(
+        "ALTER TABLE device_types ALTER COLUMN category SET DEFAULT 'sensor'"
+    ))
+    await session.commit()
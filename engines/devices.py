@@ -1,36 +1,226 @@
+from dataclasses import dataclass
+from typing import Iterable, Sequence
+
 import jwt
-from sqlalchemy import select
+from sqlalchemy import select, func, and_, update, literal_column
+from sqlalchemy.dialects.mysql import insert, Insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from models import MeasureDataModel, DeviceModel
+import config
+from engines.cache import LRUCache
+from engines.device_tokens import device_token_issuer
+from enums import DeviceCategory, DeviceStatus
+from models import MeasureDataModel, DeviceModel, DeviceLatestReadingModel, DeviceTypeModel
+
+
+@dataclass(frozen=True)
+class DeviceTokenEntry:
+    device_id: int
+    # None when no device with this id exists
+    status: DeviceStatus | None
+    garden_id: int | None = None
+
+    @property
+    def exists(self) -> bool:
+        return self.status is not None
+
+
+device_token_cache = LRUCache(
+    max_size=config.DEVICE_TOKEN_CACHE_SIZE,
+    ttl=config.DEVICE_TOKEN_CACHE_TTL,
+)
+
+# Tokens cached for each device, to invalidate them by device id. Any validly signed token is accepted, so a
+# device may have several. Tokens evicted from the cache stay here until invalidated; popping them is a no-op.
+_device_access_tokens: dict[int, set[str]] = {}
+
+
+def _upsert_latest_readings_statement(stmt: Insert) -> Insert:
+    # Only move a reading forward in time. MySQL evaluates the assignments from left to right,
+    # so value has to be compared before timestamp gets overwritten.
+    newer = stmt.inserted.timestamp >= DeviceLatestReadingModel.timestamp
+
+    return stmt.on_duplicate_key_update([
+        ("value", func.if_(newer, stmt.inserted.value, DeviceLatestReadingModel.value)),
+        ("timestamp", func.if_(newer, stmt.inserted.timestamp, DeviceLatestReadingModel.timestamp)),
+    ])
+
+
+async def upsert_devices_latest_readings(
+    session: AsyncSession,
+    rows: Sequence[dict],
+):
+    """Upsert the latest reading of each device found in the measure data rows, without committing"""
+    latest_rows: dict[int, dict] = {}
+    for row in rows:
+        current = latest_rows.get(row["device_id"])
+        if current is None or row["timestamp"] >= current["timestamp"]:
+            latest_rows[row["device_id"]] = row
+
+    if not latest_rows:
+        return
+
+    stmt = insert(DeviceLatestReadingModel).values([
+        {
+            "device_id": row["device_id"],
+            "value": row["value"],
+            "timestamp": row["timestamp"],
+        }
+        for row in latest_rows.values()
+    ])
+
+    await session.execute(_upsert_latest_readings_statement(stmt))
+
+
+async def rebuild_devices_latest_readings(session: AsyncSession):
+    """Backfill device_latest_readings from measure_datas"""
+    latest_timestamps = (
+        select(
+            MeasureDataModel.device_id,
+            func.max(MeasureDataModel.timestamp).label("timestamp"),
+        )
+        .group_by(MeasureDataModel.device_id)
+        .subquery()
+    )
+    latest_rows = (
+        select(MeasureDataModel.device_id, MeasureDataModel.display_value, MeasureDataModel.timestamp)
+        .join(
+            latest_timestamps,
+            and_(
+                MeasureDataModel.device_id == latest_timestamps.c.device_id,
+                MeasureDataModel.timestamp == latest_timestamps.c.timestamp,
+            ),
+        )
+    )
+
+    stmt = insert(DeviceLatestReadingModel).from_select(["device_id", "value", "timestamp"], latest_rows)
+
+    await session.execute(_upsert_latest_readings_statement(stmt))
+    await session.commit()
+
+
+async def get_devices_latest_values(
+    session: AsyncSession,
+    device_ids: Iterable[int],
+) -> dict[int, str]:
+    """Raw latest value of every given device that has one, looked up by primary key in device_latest_readings"""
+    device_ids = set(device_ids)
+    if not device_ids:
+        return {}
+
+    stmt = (
+        select(DeviceLatestReadingModel.device_id, DeviceLatestReadingModel.value)
+        .where(DeviceLatestReadingModel.device_id.in_(device_ids))
+    )
+
+    return dict((await session.execute(stmt)).tuples().all())
+
+
+async def get_devices_latest_measure_data(
+    session: AsyncSession,
+    devices: Sequence[DeviceModel],
+) -> dict[int, str]:
+    """Latest measure data of every given device, formatted with the unit of its device type"""
+    values = await get_devices_latest_values(session, [device.id for device in devices])
+
+    return {
+        device.id: f"{values[device.id]}{device.device_type_model.unit}" if device.id in values else "No data"
+        for device in devices
+    }
 
 
 async def get_device_latest_measure_data(
     session: AsyncSession,
     device: DeviceModel,
 ) -> str:
+    return (await get_devices_latest_measure_data(session, [device]))[device.id]
+
+
+async def verify_device_access_tokens(
+    session: AsyncSession,
+    access_tokens: Iterable[str],
+) -> dict[str, DeviceTokenEntry]:
+    """Resolve access tokens to devices, hitting the database only for tokens missing from the cache.
+
+    Tokens that can not be decoded are left out of the result.
+    """
+    entries = {}
+    unresolved = {}
+    for access_token in set(access_tokens):
+        entry = device_token_cache.get(access_token)
+        if entry is not None:
+            entries[access_token] = entry
+            continue
+
+        try:
+            device_id = device_token_issuer.decode(access_token)
+        except (jwt.PyJWTError, TypeError, ValueError):
+            continue
+        unresolved[access_token] = device_id
+
+    if unresolved:
+        stmt = (
+            select(DeviceModel.id, DeviceModel.status, DeviceModel.garden_id)
+            .where(DeviceModel.id.in_(set(unresolved.values())))
+        )
+        devices = {
+            device_id: (device_status, garden_id)
+            for device_id, device_status, garden_id in (await session.execute(stmt)).tuples().all()
+        }
+
+        for access_token, device_id in unresolved.items():
+            device_status, garden_id = devices.get(device_id, (None, None))
+            entry = DeviceTokenEntry(device_id=device_id, status=device_status, garden_id=garden_id)
+            device_token_cache.set(access_token, entry)
+            _device_access_tokens.setdefault(device_id, set()).add(access_token)
+            entries[access_token] = entry
+
+    return entries
+
+
+async def verify_device_access_token(
+    session: AsyncSession,
+    access_token: str,
+) -> DeviceTokenEntry | None:
+    return (await verify_device_access_tokens(session, [access_token])).get(access_token)
+
+
+async def set_garden_lightbulbs_state(
+    session: AsyncSession,
+    garden_id: int,
+    light_turned_on: bool,
+    device_ids: Iterable[int] | None = None,
+) -> list[int]:
+    """Switch the lightbulbs of a garden (or the given ones among them) with a single UPDATE.
+
+    Returns the ids of the updated devices; the caller commits.
+    """
     stmt = (
-        select(MeasureDataModel)
-        .where(MeasureDataModel.device_id == device.id)
-        .order_by(MeasureDataModel.timestamp.desc())
-        .limit(1)
+        select(DeviceModel.id)
+        .join(DeviceModel.device_type_model)
+        .where(DeviceModel.garden_id == garden_id)
+        .where(DeviceTypeModel.category == DeviceCategory.LIGHTBULB)
+        .order_by(DeviceModel.id.asc())
     )
+    if device_ids is not None:
+        stmt = stmt.where(DeviceModel.id.in_(set(device_ids)))
 
-    result = (await session.execute(stmt)).scalar_one_or_none()
-    if not result:
-        latest_measure_data = "No data"
-    else:
-        latest_measure_data = result.value
-        latest_measure_data = f"{latest_measure_data}{device.device_type_model.unit}"
-
-    return latest_measure_data
+    lightbulb_ids = list((await session.scalars(stmt)).all())
+    if not lightbulb_ids:
+        return []
 
+    # meta_data may be NULL, and the flag has to be stored as a JSON boolean rather than 0/1
+    state = literal_column("CAST('true' AS JSON)" if light_turned_on else "CAST('false' AS JSON)")
+    await session.execute(
+        update(DeviceModel)
+        .where(DeviceModel.id.in_(lightbulb_ids))
+        .values(meta_data=func.json_set(func.coalesce(DeviceModel.meta_data, func.json_object()), "$.light_turned_on", state))
+        .execution_options(synchronize_session=False)
+    )
 
-def get_device_id_by_access_token(access_token: str) -> int:
-    # Decode the JWT token
-    decoded_token = jwt.decode(access_token, "secret_key", algorithms=['HS256'], verify=False)
+    return lightbulb_ids
 
-    # Retrieve device_id from the decoded token
-    device_id = decoded_token.get('device_id')
 
-    return int(device_id)
+def invalidate_device_access_tokens(device_id: int):
+    for access_token in _device_access_tokens.pop(device_id, ()):
+        device_token_cache.pop(access_token)
@@ -0,0 +1,97 @@
+import asyncio
+
+from elasticsearch import ApiError, AsyncElasticsearch, ConnectionTimeout
+from elasticsearch import ConnectionError as ElasticsearchConnectionError
+from loguru import logger
+
+import config
+from engines.batching import BatchWorker
+
+
+def is_retryable_status(status: int | None) -> bool:
+    """Throttling and server errors are worth sending again, other 4xx are mapping or document errors"""
+    return status is not None and (status == 429 or status >= 500)
+
+
+class MeasureDataIndexer(BatchWorker):
+    """Mirrors committed measure data into monthly Elasticsearch indices.
+
+    Rows are queued without waiting and sent with the bulk API. When the queue
+    is full, new rows are dropped so ingest never waits on Elasticsearch.
+    Connection errors, throttling and server errors are retried, for the
+    whole request or only the rows that got them.
+    """
+
+    def __init__(self, index_prefix: str, **kwargs):
+        super().__init__(**kwargs)
+        self.index_prefix = index_prefix
+        self._client: AsyncElasticsearch | None = None
+
+    async def start(self, client: AsyncElasticsearch):
+        self._client = client
+        await super().start()
+
+    def get_index(self, row: dict) -> str:
+        return f"{self.index_prefix}-{row['timestamp']:%Y.%m}"
+
+    def enqueue(self, rows: list[dict]):
+        if self._task is None:
+            return
+
+        dropped = 0
+        for row in rows:
+            try:
+                self._queue.put_nowait(row)
+            except asyncio.QueueFull:
+                dropped += 1
+
+        if dropped:
+            self.dropped += dropped
+            logger.warning(f"Indexing queue is full, dropped {dropped} measure data rows")
+
+    def _get_operations(self, rows: list[dict]) -> list[dict]:
+        operations = []
+        for row in rows:
+            operations.append({"index": {"_index": self.get_index(row)}})
+            operations.append({
+                "device_id": row["device_id"],
+                "timestamp": row["timestamp"].isoformat(),
+                "value": row["value"],
+                "numeric_value": row["numeric_value"],
+            })
+        return operations
+
+    async def _flush(self, rows: list[dict]) -> list[dict]:
+        try:
+            response = await self._client.bulk(operations=self._get_operations(rows))
+        except (ElasticsearchConnectionError, ConnectionTimeout) as error:
+            logger.warning(f"Bulk indexing of {len(rows)} measure data rows failed: {error}")
+            return rows
+        except ApiError as error:
+            if not is_retryable_status(error.status_code):
+                logger.error(f"Dropping {len(rows)} measure data rows rejected by Elasticsearch: {error}")
+                return []
+            logger.warning(f"Bulk indexing of {len(rows)} measure data rows failed: {error}")
+            return rows
+
+        if not response["errors"]:
+            return []
+
+        retry = []
+        for row, item in zip(rows, response["items"]):
+            result = item["index"]
+            if is_retryable_status(result.get("status")):
+                retry.append(row)
+            elif "error" in result:
+                logger.error(f"Measure data row was rejected by Elasticsearch: {result['error']}")
+
+        return retry
+
+measure_data_indexer = MeasureDataIndexer(
+    index_prefix=config.ELASTICSEARCH_INDEX_PREFIX,
+    max_retries=config.ELASTICSEARCH_MAX_RETRIES,
+    retry_backoff=config.ELASTICSEARCH_RETRY_BACKOFF,
+    max_size=config.ELASTICSEARCH_QUEUE_SIZE,
+    flush_size=config.ELASTICSEARCH_BULK_SIZE,
+    flush_interval=config.ELASTICSEARCH_FLUSH_INTERVAL_MS / 1000,
+)
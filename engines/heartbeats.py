@@ -0,0 +1,91 @@
+import asyncio
+from datetime import datetime
+
+from loguru import logger
+from sqlalchemy import update, case
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+from db import async_session
+from engines.background import BackgroundService
+from models import DeviceModel
+
+
+class HeartbeatRecorder(BackgroundService):
+    """Coalesce device pings in memory and persist them periodically.
+
+    Only the latest ping of each device is kept, and every flush writes all
+    of them with a single UPDATE. Readers of `last_ping` should go through
+    `get_last_ping` to see pings that are not flushed yet, or that were
+    flushed after the stored value was read (e.g. from a cache).
+    """
+
+    def __init__(self, flush_interval: float, chunk_size: int = 1000):
+        super().__init__()
+        self.flush_interval = flush_interval
+        self.chunk_size = chunk_size
+        self._pending: dict[int, datetime] = {}
+        self._flushing: dict[int, datetime] = {}
+        self._flushed: dict[int, datetime] = {}
+
+    async def stop(self):
+        if self._task is None:
+            return
+        await super().stop()
+
+        # Shielded as well, so cancelling shutdown doesn't lose the pings being written
+        await asyncio.shield(self.flush())
+
+    def record(self, device_id: int, timestamp: datetime | None = None):
+        self._pending[device_id] = timestamp or datetime.now()
+
+    def get_last_ping(self, device_id: int, stored: datetime | None) -> datetime | None:
+        candidates = [
+            last_ping
+            for last_ping in (
+                stored,
+                self._flushed.get(device_id),
+                self._flushing.get(device_id),
+                self._pending.get(device_id),
+            )
+            if last_ping is not None
+        ]
+        return max(candidates, default=None)
+
+    async def flush(self):
+        if not self._pending:
+            return
+
+        self._flushing, self._pending = self._pending, {}
+        try:
+            async with async_session() as session:
+                await self._write(session, self._flushing)
+            self._flushed.update(self._flushing)
+        except Exception:
+            logger.exception(f"Failed to flush {len(self._flushing)} device heartbeats")
+            # Keep them for the next flush unless the device pinged again meanwhile
+            for device_id, last_ping in self._flushing.items():
+                self._pending.setdefault(device_id, last_ping)
+        finally:
+            self._flushing = {}
+
+    async def _write(self, session: AsyncSession, pings: dict[int, datetime]):
+        items = sorted(pings.items())
+        for i in range(0, len(items), self.chunk_size):
+            chunk = dict(items[i:i + self.chunk_size])
+            await session.execute(
+                update(DeviceModel)
+                .where(DeviceModel.id.in_(list(chunk)))
+                .values(last_ping=case(chunk, value=DeviceModel.id))
+                .execution_options(synchronize_session=False)
+            )
+
+        await session.commit()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._shielded(self.flush())
+
+
+heartbeat_recorder = HeartbeatRecorder(flush_interval=config.HEARTBEAT_FLUSH_INTERVAL)
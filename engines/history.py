@@ -0,0 +1,309 @@
+import calendar
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Sequence
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+from engines.archive import load_devices_series, measure_data_archive, to_datetime64
+from engines.cache import LRUCache
+from engines.compaction import retention_policy
+from engines.rollups import get_bucket_expression, to_bucket
+from enums import DeviceDataGroupBy, DeviceHistoryStatistic
+from models import MeasureDataModel, MeasureDataRollupModel
+
+GROUP_BY_TO_TIME_UNIT = {
+    DeviceDataGroupBy.HOUR: 'hour',
+    DeviceDataGroupBy.DAY: 'day',
+    DeviceDataGroupBy.MONTH: 'month',
+}
+
+# Rough size in bytes of one cached history item, used to bound the cache memory
+HISTORY_ITEM_SIZE = 256
+
+# History values keyed by (device_id, group_by, start of the period, statistic)
+history_cache = LRUCache(
+    max_size=config.HISTORY_CACHE_SIZE,
+    max_weight=config.HISTORY_CACHE_MAX_BYTES,
+    weigh=lambda values: len(values) * HISTORY_ITEM_SIZE,
+)
+
+# Bumped every time cached history of a device is invalidated. A read that started
+# before the bump may have seen older data, so it doesn't cache what it computed.
+_history_generations: dict[int, int] = {}
+
+
+def get_history_range(group_by: DeviceDataGroupBy, group_value: datetime) -> tuple[datetime, datetime]:
+    if group_by == DeviceDataGroupBy.HOUR:
+        # The whole day of group_value
+        first = datetime.combine(group_value, datetime.min.time())
+        last = datetime.combine(group_value, datetime.max.time())
+    elif group_by == DeviceDataGroupBy.DAY:
+        # The whole month of group_value
+        _, last_day_of_month = calendar.monthrange(group_value.year, group_value.month)
+        first = group_value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        last = group_value.replace(day=last_day_of_month, hour=23, minute=59, second=59, microsecond=999999)
+    else:
+        # The whole year of group_value
+        first = group_value.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+        last = group_value.replace(month=12, day=31, hour=23, minute=59, second=59, microsecond=999999)
+
+    return first, last
+
+
+def get_history_buckets(group_by: DeviceDataGroupBy, group_value: datetime) -> list[tuple[datetime, str]]:
+    """Start and label of every bucket of the selected period"""
+    first, _ = get_history_range(group_by, group_value)
+
+    if group_by == DeviceDataGroupBy.HOUR:
+        return [(first + timedelta(hours=hour), f"{hour}:00") for hour in range(24)]
+    if group_by == DeviceDataGroupBy.DAY:
+        _, last_day_of_month = calendar.monthrange(first.year, first.month)
+        return [(first.replace(day=day), f"{day}") for day in range(1, last_day_of_month + 1)]
+    return [(first.replace(month=month), f"{month}") for month in range(1, 13)]
+
+
+# Value of a bucket without readings. The mean keeps the "0.0" clients have always received,
+# the other statistics have no meaningful value then, e.g. once raw readings were compacted.
+EMPTY_BUCKET_VALUES = {
+    DeviceHistoryStatistic.COUNT: "0",
+    DeviceHistoryStatistic.MEAN: "0.0",
+}
+
+
+def build_history_values(
+    group_by: DeviceDataGroupBy,
+    group_value: datetime,
+    values: dict[datetime, float],
+    statistic: DeviceHistoryStatistic = DeviceHistoryStatistic.MEAN,
+) -> list[dict]:
+    empty_value = EMPTY_BUCKET_VALUES.get(statistic)
+    return [
+        {
+            'timestamp': label,
+            'value': str(round(values[bucket], 2)) if bucket in values else empty_value,
+        }
+        for bucket, label in get_history_buckets(group_by, group_value)
+    ]
+
+
+def _quantile(sorted_values: np.ndarray, offsets: np.ndarray, counts: np.ndarray, q: float) -> np.ndarray:
+    """Linearly interpolated quantile of each bucket, like np.quantile, for values sorted within buckets"""
+    position = q * (counts - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, counts - 1)
+    fraction = position - lower
+
+    lower_values = sorted_values[offsets + lower]
+    return lower_values + fraction * (sorted_values[offsets + upper] - lower_values)
+
+
+def aggregate_series(
+    group_by: DeviceDataGroupBy,
+    group_value: datetime,
+    timestamps: np.ndarray,
+    values: np.ndarray,
+    statistic: DeviceHistoryStatistic,
+) -> dict[datetime, float]:
+    """The statistic of each non-empty bucket of the period, for time ordered readings.
+
+    All buckets are computed at once with vectorized operations. Readings
+    are only sorted by (bucket, value) for the statistics that need it.
+    """
+    buckets = [bucket for bucket, _ in get_history_buckets(group_by, group_value)]
+    bucket_index = np.searchsorted(to_datetime64(buckets), timestamps, side="right") - 1
+
+    counts = np.bincount(bucket_index, minlength=len(buckets))
+    present = np.flatnonzero(counts)
+
+    if statistic == DeviceHistoryStatistic.COUNT:
+        bucket_values = counts[present]
+    elif statistic == DeviceHistoryStatistic.MEAN:
+        sums = np.bincount(bucket_index, weights=values, minlength=len(buckets))
+        bucket_values = sums[present] / counts[present]
+    else:
+        offsets = (np.cumsum(counts) - counts)[present]
+        counts = counts[present]
+        sorted_values = values[np.lexsort((values, bucket_index))]
+
+        if statistic == DeviceHistoryStatistic.MIN:
+            bucket_values = sorted_values[offsets]
+        elif statistic == DeviceHistoryStatistic.MAX:
+            bucket_values = sorted_values[offsets + counts - 1]
+        else:
+            bucket_values = _quantile(sorted_values, offsets, counts, QUANTILES[statistic])
+
+    return {buckets[i]: float(value) for i, value in zip(present, bucket_values)}
+
+
+# Statistics that the rollups can answer, the others need the raw readings
+ROLLUP_STATISTICS = {
+    DeviceHistoryStatistic.COUNT: MeasureDataRollupModel.value_count,
+    DeviceHistoryStatistic.MEAN: MeasureDataRollupModel.value_sum / MeasureDataRollupModel.value_count,
+    DeviceHistoryStatistic.MIN: MeasureDataRollupModel.value_min,
+    DeviceHistoryStatistic.MAX: MeasureDataRollupModel.value_max,
+}
+
+QUANTILES = {
+    DeviceHistoryStatistic.MEDIAN: 0.5,
+    DeviceHistoryStatistic.P95: 0.95,
+}
+
+
+def get_quantile_statement(
+    device_ids: Sequence[int],
+    group_by: DeviceDataGroupBy,
+    first: datetime,
+    last: datetime,
+    q: float,
+):
+    """Quantile of the raw readings of each (device, bucket), interpolated like np.quantile.
+
+    Readings are ranked within their bucket with window functions, so the
+    database sends back one row per bucket instead of every reading.
+    """
+    bucket = get_bucket_expression(group_by)
+    partition = (MeasureDataModel.device_id, bucket)
+    ranked = (
+        select(
+            MeasureDataModel.device_id,
+            bucket.label("bucket"),
+            MeasureDataModel.numeric_value.label("value"),
+            func.row_number()
+            .over(partition_by=partition, order_by=MeasureDataModel.numeric_value)
+            .label("value_position"),
+            func.count().over(partition_by=partition).label("value_count"),
+        )
+        .where(MeasureDataModel.device_id.in_(set(device_ids)))
+        .where(MeasureDataModel.timestamp.between(first, last))
+        .where(MeasureDataModel.numeric_value.is_not(None))
+        .subquery()
+    )
+
+    # Zero based fractional position of the quantile, and the one based position of the reading below it.
+    # The readings at `lower` and the next position are ordered by value, so min and max tell them apart.
+    position = q * (ranked.c.value_count - 1)
+    lower = func.floor(position) + 1
+    lower_value, upper_value = func.min(ranked.c.value), func.max(ranked.c.value)
+
+    return (
+        select(
+            ranked.c.device_id,
+            ranked.c.bucket,
+            lower_value + func.max(position - func.floor(position)) * (upper_value - lower_value),
+        )
+        .where(ranked.c.value_position.between(lower, lower + 1))
+        .group_by(ranked.c.device_id, ranked.c.bucket)
+    )
+
+
+async def get_devices_history_values(
+    session: AsyncSession,
+    device_ids: Sequence[int],
+    group_by: DeviceDataGroupBy,
+    group_value: datetime,
+    statistic: DeviceHistoryStatistic = DeviceHistoryStatistic.MEAN,
+) -> dict[int, list[dict]]:
+    """The statistic of each bucket of the period for several devices.
+
+    Count, mean, min and max are read from the rollups with one grouped
+    query for all devices. The median and p95 are computed in the database
+    from the raw readings, and with numpy for buckets whose readings may
+    have been moved to the archive, so they are only available while those
+    are kept.
+
+    Closed periods are cached for HISTORY_CACHE_CLOSED_PERIOD_TTL seconds,
+    the current one for HISTORY_CACHE_OPEN_PERIOD_TTL seconds, or either
+    until a reading lands in it.
+    """
+    first, last = get_history_range(group_by, group_value)
+    generations = {device_id: _history_generations.get(device_id, 0) for device_id in device_ids}
+
+    history = {}
+    for device_id in device_ids:
+        values = history_cache.get((device_id, group_by, first, statistic))
+        if values is not None:
+            history[device_id] = values
+
+    device_ids = [device_id for device_id in device_ids if device_id not in history]
+    if not device_ids:
+        return history
+
+    results: dict[int, dict[datetime, float]] = {device_id: {} for device_id in device_ids}
+
+    if statistic in ROLLUP_STATISTICS:
+        stmt = (
+            select(
+                MeasureDataRollupModel.device_id,
+                MeasureDataRollupModel.bucket,
+                ROLLUP_STATISTICS[statistic],
+            )
+            .where(MeasureDataRollupModel.device_id.in_(set(device_ids)))
+            .where(MeasureDataRollupModel.granularity == group_by.value)
+            .where(MeasureDataRollupModel.bucket.between(first, last))
+        )
+        for device_id, bucket, value in (await session.execute(stmt)).tuples():
+            results[device_id][bucket] = value
+
+    # Buckets starting before archive_end may have readings that are only left in the archive: raw readings
+    # before raw_cutoff, and for the hourly history the readings behind hourly rollups pruned before hourly_cutoff
+    raw_cutoff, hourly_cutoff = retention_policy.get_cutoffs(datetime.now())
+    archive_end = None
+    if measure_data_archive is not None:
+        if statistic in QUANTILES:
+            archive_end = raw_cutoff
+        elif group_by == DeviceDataGroupBy.HOUR:
+            archive_end = hourly_cutoff
+
+    buckets = [bucket for bucket, _ in get_history_buckets(group_by, group_value)]
+    archived_buckets = bisect_left(buckets, archive_end) if archive_end is not None else 0
+    # Start of the first bucket left to the database, if any
+    live_start = buckets[archived_buckets] if archived_buckets < len(buckets) else None
+
+    if statistic in QUANTILES and live_start is not None:
+        stmt = get_quantile_statement(device_ids, group_by, live_start, last, QUANTILES[statistic])
+        for device_id, bucket, value in (await session.execute(stmt)).tuples():
+            results[device_id][to_bucket(bucket)] = value
+
+    if archived_buckets:
+        archived_last = live_start - timedelta(microseconds=1) if live_start is not None else last
+        series = await load_devices_series(session, device_ids, first, archived_last)
+        for device_id, (timestamps, values) in series.items():
+            for bucket, value in aggregate_series(group_by, group_value, timestamps, values, statistic).items():
+                results[device_id].setdefault(bucket, value)
+
+    ttl = config.HISTORY_CACHE_CLOSED_PERIOD_TTL if last < datetime.now() else config.HISTORY_CACHE_OPEN_PERIOD_TTL
+    for device_id, device_values in results.items():
+        history[device_id] = build_history_values(group_by, group_value, device_values, statistic)
+        if _history_generations.get(device_id, 0) == generations[device_id]:
+            history_cache.set((device_id, group_by, first, statistic), history[device_id], ttl=ttl)
+
+    return history
+
+
+def invalidate_history_cache(rows: Sequence[dict]):
+    """Drop the cached periods the given measure data rows fall into"""
+    for device_id in {row["device_id"] for row in rows}:
+        _history_generations[device_id] = _history_generations.get(device_id, 0) + 1
+
+    keys = {
+        (row["device_id"], group_by, get_history_range(group_by, row["timestamp"])[0], statistic)
+        for row in rows
+        for group_by in DeviceDataGroupBy
+        for statistic in DeviceHistoryStatistic
+    }
+    for key in keys:
+        history_cache.pop(key)
+
+
+async def get_device_history_values(
+    session: AsyncSession,
+    device_id: int,
+    group_by: DeviceDataGroupBy,
+    group_value: datetime,
+    statistic: DeviceHistoryStatistic = DeviceHistoryStatistic.MEAN,
+) -> list[dict]:
+    return (await get_devices_history_values(session, [device_id], group_by, group_value, statistic))[device_id]
@@ -0,0 +1,52 @@
+import asyncio
+
+import config
+from db import async_session
+from engines.batching import BatchWorker
+from engines.measure_data import save_measure_data
+
+
+class IngestBufferFull(Exception):
+    pass
+
+
+class IngestBuffer(BatchWorker):
+    """Write-behind buffer for measure data.
+
+    Rows are queued in memory and flushed with one bulk INSERT whenever
+    `flush_size` rows are waiting or `flush_interval` seconds have passed
+    since the first row of the batch, whichever comes first.
+
+    A batch that fails to be written is retried with exponential backoff.
+    Rows are only dropped once `max_retries` retries have failed too; while
+    retrying no new batch is written, so producers wait on the full buffer.
+    """
+
+    async def put(self, row: dict):
+        """Queue a row, waiting for room when the buffer is full"""
+        if self._task is None:
+            raise RuntimeError("Ingest buffer is not running")
+
+        await self._queue.put(row)
+
+    def put_nowait(self, row: dict):
+        if self._task is None:
+            raise RuntimeError("Ingest buffer is not running")
+
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            raise IngestBufferFull()
+
+    async def _flush(self, rows: list[dict]):
+        async with async_session() as session:
+            await save_measure_data(session, rows)
+
+
+ingest_buffer = IngestBuffer(
+    max_retries=config.INGEST_FLUSH_MAX_RETRIES,
+    retry_backoff=config.INGEST_FLUSH_RETRY_BACKOFF,
+    max_size=config.INGEST_BUFFER_MAX_SIZE,
+    flush_size=config.INGEST_FLUSH_SIZE,
+    flush_interval=config.INGEST_FLUSH_INTERVAL_MS / 1000,
+)
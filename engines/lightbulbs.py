@@ -0,0 +1,38 @@
+from typing import Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+from engines.catalog import catalog_cache
+from engines.mqtt import mqtt_publisher
+from engines.pubsub import publish_lightbulb_state
+
+
+async def switch_lightbulbs(
+    session: AsyncSession,
+    garden_id: int,
+    light_turned_on: bool,
+    set_state: Callable[[], Awaitable[list[int]]],
+) -> list[int]:
+    """Store a new lightbulb state with `set_state`, commit it and send it to the lightbulbs.
+
+    `set_state` updates the session and returns the ids of the switched
+    lightbulbs, which all belong to `garden_id`. Room for the MQTT command
+    is held before committing, so when the publisher is busy
+    MQTTPublisherBusy is raised and the state is left untouched.
+    """
+    with mqtt_publisher.reserve() as publish_command:
+        device_ids = await set_state()
+        await session.commit()
+        catalog_cache.invalidate_devices()
+
+        for device_id in device_ids:
+            publish_lightbulb_state(garden_id, device_id, light_turned_on)
+
+        payload = "1" if light_turned_on else "0"
+        publish_command([
+            (config.MQTT_LIGHTBULB_DEVICE_TOPIC.format(device_id=device_id), payload)
+            for device_id in device_ids
+        ])
+
+    return device_ids
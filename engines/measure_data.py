@@ -0,0 +1,165 @@
+import csv
+import io
+import json
+import math
+import re
+from datetime import datetime
+from typing import AsyncIterator
+
+from sqlalchemy import insert, inspect, select, func, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import async_session
+from engines.devices import upsert_devices_latest_readings
+from engines.elasticsearch import measure_data_indexer
+from engines.history import invalidate_history_cache
+from engines.rollups import upsert_measure_data_rollups
+from enums import MeasureDataExportFormat
+from models import MeasureDataModel
+
+# Shared with the SQL backfill so that old and new rows are classified the same way
+NUMERIC_VALUE_PATTERN = r"^[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?$"
+_numeric_value_re = re.compile(NUMERIC_VALUE_PATTERN)
+
+
+def parse_numeric_value(value: str) -> float | None:
+    if not _numeric_value_re.match(value):
+        return None
+
+    number = float(value)
+    return number if math.isfinite(number) else None
+
+
+def to_local_naive(timestamp: datetime | None) -> datetime:
+    # measure_datas.timestamp is a naive local datetime, so convert aware values before storing them
+    if timestamp is None:
+        return datetime.now()
+    if timestamp.tzinfo is not None:
+        return timestamp.astimezone().replace(tzinfo=None)
+    return timestamp
+
+
+async def save_measure_data(
+    session: AsyncSession,
+    rows: list[dict],
+) -> None:
+    """Insert measure data rows with a single multi-row INSERT and commit them
+    together with the devices latest readings and rollups. Committed rows are
+    then mirrored to Elasticsearch.
+
+    Each row holds the raw `value` received from the device; numeric values
+    are stored in `numeric_value` only.
+    """
+    if not rows:
+        return
+
+    for row in rows:
+        row["numeric_value"] = parse_numeric_value(row["value"])
+
+    await session.execute(
+        insert(MeasureDataModel),
+        [
+            {
+                "device_id": row["device_id"],
+                "timestamp": row["timestamp"],
+                "numeric_value": row["numeric_value"],
+                "value": row["value"] if row["numeric_value"] is None else None,
+            }
+            for row in rows
+        ],
+    )
+    await upsert_devices_latest_readings(session, rows)
+    await upsert_measure_data_rollups(session, rows)
+    await session.commit()
+
+    invalidate_history_cache(rows)
+    measure_data_indexer.enqueue(rows)
+
+
+async def migrate_measure_data_values(
+    session: AsyncSession,
+    chunk_size: int = 10000,
+):
+    """Add numeric_value and the (device_id, timestamp) and timestamp indexes to
+    measure_datas, then move numeric payloads out of the string column in chunks"""
+    connection = await session.connection()
+    columns = await connection.run_sync(
+        lambda sync_connection: {column["name"] for column in inspect(sync_connection).get_columns("measure_datas")}
+    )
+    if "numeric_value" not in columns:
+        await session.execute(text(
+            "ALTER TABLE measure_datas "
+            "ADD COLUMN numeric_value DOUBLE NULL AFTER timestamp, "
+            "MODIFY value VARCHAR(256) NULL, "
+            "ADD INDEX ix_measure_datas_device_id_timestamp (device_id, timestamp)"
+        ))
+
+    indexes = await connection.run_sync(
+        lambda sync_connection: {index["name"] for index in inspect(sync_connection).get_indexes("measure_datas")}
+    )
+    if "ix_measure_datas_timestamp" not in indexes:
+        await session.execute(text("ALTER TABLE measure_datas ADD INDEX ix_measure_datas_timestamp (timestamp)"))
+
+    max_id = (await session.execute(select(func.max(MeasureDataModel.id)))).scalar() or 0
+
+    backfill = text(
+        "UPDATE measure_datas "
+        "SET numeric_value = value + 0e0, value = NULL "
+        "WHERE id > :start AND id <= :end AND value REGEXP :pattern"
+    )
+    for start in range(0, max_id, chunk_size):
+        await session.execute(backfill, {"start": start, "end": start + chunk_size, "pattern": NUMERIC_VALUE_PATTERN})
+        await session.commit()
+
+
+def _encode_ndjson(rows) -> str:
+    return "".join(
+        json.dumps({
+            "timestamp": timestamp.isoformat(),
+            "value": numeric_value if numeric_value is not None else value,
+        }) + "\n"
+        for timestamp, numeric_value, value in rows
+    )
+
+
+def _encode_csv(rows) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(
+        (timestamp.isoformat(), numeric_value if numeric_value is not None else value)
+        for timestamp, numeric_value, value in rows
+    )
+    return buffer.getvalue()
+
+
+async def export_measure_data(
+    device_id: int,
+    start: datetime,
+    end: datetime,
+    export_format: MeasureDataExportFormat,
+    chunk_size: int = 1000,
+) -> AsyncIterator[str]:
+    """Stream the raw measure data of a device as NDJSON or CSV chunks.
+
+    Rows are read through a server-side cursor, `chunk_size` at a time, so
+    memory use does not depend on the size of the range. The generator owns
+    its session because it outlives the request handler.
+    """
+    stmt = (
+        select(MeasureDataModel.timestamp, MeasureDataModel.numeric_value, MeasureDataModel.value)
+        .where(MeasureDataModel.device_id == device_id)
+        .where(MeasureDataModel.timestamp.between(start, end))
+        .order_by(MeasureDataModel.timestamp.asc())
+        .execution_options(yield_per=chunk_size)
+    )
+
+    if export_format == MeasureDataExportFormat.CSV:
+        encode = _encode_csv
+        yield "timestamp,value\r\n"
+    else:
+        encode = _encode_ndjson
+
+    async with async_session() as session:
+        result = await session.stream(stmt)
+        async for rows in result.partitions():
+            yield encode(rows)
@@ -0,0 +1,259 @@
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import Counter as StatementCounter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator
+
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import config
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable) -> str:
+    labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return f"{{{labels}}}" if labels else ""
+
+
+class Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+
+    @abstractmethod
+    def collect(self) -> Iterator[str]:
+        """Sample lines of the metric, without the HELP and TYPE header"""
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} {self.type}"
+        yield from self.collect()
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self) -> Iterator[str]:
+        for label_values, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.label_names, label_values)} {value}"
+
+
+class Histogram(Metric):
+    """Bucket counts are kept per bucket and only made cumulative when rendered"""
+
+    type = "histogram"
+
+    def __init__(self, *args, buckets: tuple[float, ...] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = buckets
+        # label values -> (bucket counts with a trailing +Inf bucket, [sum, count])
+        self._values: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *label_values):
+        counts, totals = self._values.get(label_values) or self._values.setdefault(
+            label_values, ([0] * (len(self.buckets) + 1), [0.0, 0]),
+        )
+        counts[bisect_left(self.buckets, value)] += 1
+        totals[0] += value
+        totals[1] += 1
+
+    def collect(self) -> Iterator[str]:
+        label_names = (*self.label_names, "le")
+        for label_values, (counts, (total, count)) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels(label_names, (*label_values, bound))} {cumulative}"
+
+            labels = _format_labels(self.label_names, label_values)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Gauge(Metric):
+    """Read from `read` at scrape time, which yields (label values, value) pairs"""
+
+    type = "gauge"
+
+    def __init__(self, *args, read: Callable[[], Iterable[tuple[tuple, float]]], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read = read
+
+    def collect(self) -> Iterator[str]:
+        for label_values, value in self.read():
+            yield f"{self.name}{_format_labels(self.label_names, label_values)} {value}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+registry = MetricsRegistry()
+
+request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route", "status"),
+))
+request_db_queries = registry.register(Histogram(
+    "http_request_db_queries", "Database queries run by one HTTP request", ("route",),
+    buckets=QUERY_COUNT_BUCKETS,
+))
+request_db_duration = registry.register(Histogram(
+    "http_request_db_duration_seconds", "Time spent in the database by one HTTP request", ("route",),
+))
+request_n_plus_one = registry.register(Counter(
+    "http_request_n_plus_one_total", "HTTP requests that ran the same statement repeatedly", ("route",),
+))
+db_query_duration = registry.register(Histogram(
+    "db_query_duration_seconds", "Database query latency",
+))
+db_pool_checkout_wait = registry.register(Histogram(
+    "db_pool_checkout_wait_seconds", "Time waited for a pooled database connection",
+))
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_time: float = 0.0
+    statements: StatementCounter = field(default_factory=StatementCounter)
+
+
+_request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long checkouts wait for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_checkout_wait.observe(time.perf_counter() - start)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_start
+    db_query_duration.observe(elapsed)
+
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+        stats.statements[statement] += 1
+
+
+def _read_pool(pool) -> Iterator[tuple[tuple, float]]:
+    # Only queue pools can report their state
+    for state in ("size", "checkedin", "checkedout", "overflow"):
+        read = getattr(pool, state, None)
+        if read is not None:
+            yield (state,), read()
+
+
+def instrument_engine(engine: AsyncEngine):
+    """Time every query of `engine`, attribute it to the current request and expose its pool state"""
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+    registry.register(Gauge(
+        "db_pool_connections", "Database connection pool state", ("state",),
+        read=lambda: _read_pool(engine.sync_engine.pool),
+    ))
+
+
+def register_caches(caches: dict[str, object]):
+    """Expose the `stats()` of in-process caches, keyed by cache name"""
+    def read() -> Iterator[tuple[tuple, float]]:
+        for cache_name, cache in caches.items():
+            for stat, value in cache.stats().items():
+                yield (cache_name, stat), value
+
+    registry.register(Gauge("cache_stats", "In-process cache statistics", ("cache", "stat"), read=read))
+
+
+def register_gauge(name: str, description: str, read: Callable[[], float]):
+    registry.register(Gauge(name, description, read=lambda: [((), read())]))
+
+
+def _record_request(scope: Scope, status_code: int, elapsed: float, stats: RequestStats):
+    # Label by route template rather than path, so ids don't blow up the number of series
+    route = scope.get("route")
+    route_path = route.path if route is not None else "unmatched"
+
+    request_duration.observe(elapsed, scope["method"], route_path, status_code)
+    request_db_queries.observe(stats.queries, route_path)
+    request_db_duration.observe(stats.db_time, route_path)
+
+    if stats.statements:
+        statement, repeats = stats.statements.most_common(1)[0]
+        if repeats >= config.METRICS_N_PLUS_ONE_THRESHOLD:
+            request_n_plus_one.inc(route_path)
+            logger.warning(f"{scope['method']} {route_path} ran the same statement {repeats} times: {statement[:200]}")
+
+
+class MetricsMiddleware:
+    """Records latency and database usage of every HTTP request.
+
+    Plain ASGI middleware rather than BaseHTTPMiddleware, so streaming
+    responses pass through untouched.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            _record_request(scope, status_code, time.perf_counter() - start, stats)
@@ -0,0 +1,247 @@
+import asyncio
+import ssl
+from abc import abstractmethod
+from collections import deque
+from contextlib import contextmanager, suppress
+from datetime import datetime
+from typing import Callable, Iterator
+from urllib.parse import urlparse
+
+from asyncio_mqtt import Client, MqttError, Message
+from loguru import logger
+from pydantic import ValidationError
+
+import config
+from db import async_session
+from engines.background import BackgroundService
+from engines.devices import verify_device_access_token
+from engines.ingest import ingest_buffer
+from engines.pubsub import publish_measure_data
+from schemas.measure_data import MeasureDataSchema
+
+
+class MQTTPublisherBusy(Exception):
+    pass
+
+
+def get_client_params(broker_url: str) -> dict:
+    """Client keyword arguments for a mqtt:// or mqtts:// broker url"""
+    url = urlparse(broker_url)
+    use_tls = url.scheme == "mqtts"
+
+    params = {
+        "hostname": url.hostname,
+        "port": url.port or (8883 if use_tls else 1883),
+        "username": url.username,
+        "password": url.password,
+    }
+    if use_tls:
+        params["tls_context"] = ssl.create_default_context()
+
+    return params
+
+
+class MQTTService(BackgroundService):
+    """Background task holding a MQTT connection, reconnecting with exponential backoff"""
+
+    def __init__(
+        self,
+        broker_url: str,
+        reconnect_interval: float,
+        max_reconnect_interval: float,
+        client_factory: Callable[..., Client] = Client,
+    ):
+        super().__init__()
+        self.broker_url = broker_url
+        self.reconnect_interval = reconnect_interval
+        self.max_reconnect_interval = max_reconnect_interval
+        self.client_factory = client_factory
+        self.connected = False
+
+    async def _run(self):
+        backoff = self.reconnect_interval
+
+        while True:
+            try:
+                async with self.client_factory(**get_client_params(self.broker_url)) as client:
+                    self.connected = True
+                    backoff = self.reconnect_interval
+                    await self._serve(client)
+            except MqttError as error:
+                logger.warning(f"MQTT connection to {self.broker_url} lost: {error}, reconnecting in {backoff}s")
+            except Exception:
+                # Anything else would end the task for good and silently stop publishing or ingesting
+                logger.exception(f"MQTT client for {self.broker_url} failed, reconnecting in {backoff}s")
+            finally:
+                self.connected = False
+
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_reconnect_interval)
+
+    @abstractmethod
+    async def _serve(self, client: Client):
+        """Use the connected client until the connection drops"""
+
+
+class MQTTPublisher(MQTTService):
+    """Long-lived MQTT connection shared by every command path.
+
+    Commands go through a bounded queue and are published by the background
+    task. A command is the list of messages sent for one request, so the queue
+    holds at most `queue_size` commands however many devices each one reaches.
+    A message that failed to publish is retried after reconnecting.
+    """
+
+    def __init__(self, queue_size: int, **kwargs):
+        super().__init__(**kwargs)
+        self._queue: asyncio.Queue[deque[tuple[str, str | bytes]]] = asyncio.Queue(maxsize=queue_size)
+        self._reserved = 0
+        self._queued_messages = 0
+        self._current: deque[tuple[str, str | bytes]] | None = None
+
+    async def stop(self, timeout: float = 5):
+        # Give queued messages a chance to go out before closing the connection
+        if self._task is not None:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._queue.join(), timeout)
+
+        await super().stop()
+
+    @property
+    def full(self) -> bool:
+        return self._queue.qsize() + self._reserved >= self._queue.maxsize
+
+    @property
+    def queued(self) -> int:
+        """Messages waiting to be published"""
+        return self._queued_messages
+
+    @contextmanager
+    def reserve(self) -> Iterator[Callable[[list[tuple[str, str | bytes]]], None]]:
+        """Hold a queue slot for one command and yield the function that queues it.
+
+        Raises MQTTPublisherBusy before entering the block when the queue is
+        full, so callers can give up before committing the state change
+        the command is about.
+        """
+        if self.full:
+            raise MQTTPublisherBusy()
+
+        self._reserved += 1
+        try:
+            yield self._put
+        finally:
+            self._reserved -= 1
+
+    def publish(self, topic: str, payload: str | bytes):
+        self.publish_many([(topic, payload)])
+
+    def publish_many(self, messages: list[tuple[str, str | bytes]]):
+        """Queue all messages as one command, so a burst is never cut in half"""
+        with self.reserve() as put:
+            put(messages)
+
+    def _put(self, messages: list[tuple[str, str | bytes]]):
+        if messages:
+            # Can't overflow, the caller holds a reserved slot
+            self._queue.put_nowait(deque(messages))
+            self._queued_messages += len(messages)
+
+    async def _serve(self, client: Client):
+        while True:
+            if self._current is None:
+                self._current = await self._queue.get()
+
+            while self._current:
+                topic, payload = self._current[0]
+                await client.publish(topic, payload=payload)
+                self._current.popleft()
+                self._queued_messages -= 1
+
+            self._current = None
+            self._queue.task_done()
+
+
+class MQTTIngestSubscriber(MQTTService):
+    """Consume measure data published by devices and feed it to the ingest buffer.
+
+    Devices publish a MeasureDataSchema JSON payload on their own topic,
+    where the `+` level of `topic` is their device id.
+
+    Received messages wait in a queue of at most `queue_size` messages while
+    earlier ones are ingested. When it is full the client discards new
+    messages (and logs a warning) instead of growing without bound.
+    """
+
+    def __init__(self, topic: str, queue_size: int, **kwargs):
+        super().__init__(**kwargs)
+        self.topic = topic
+        self.queue_size = queue_size
+        self._device_id_level: int | None = None
+
+    async def start(self):
+        # Checked here rather than at import, so a bad topic only matters when ingest is enabled
+        levels = self.topic.split("/")
+        if levels.count("+") != 1:
+            raise ValueError(
+                f"MQTT_INGEST_TOPIC must have exactly one '+' level for the device id, got {self.topic!r}"
+            )
+        self._device_id_level = levels.index("+")
+
+        await super().start()
+
+    def get_topic_device_id(self, topic: str) -> int | None:
+        levels = topic.split("/")
+        try:
+            return int(levels[self._device_id_level])
+        except (IndexError, ValueError):
+            return None
+
+    async def _serve(self, client: Client):
+        async with client.messages(queue_maxsize=self.queue_size) as messages:
+            await client.subscribe(self.topic, qos=1)
+            async for message in messages:
+                try:
+                    await self._handle(message)
+                except Exception:
+                    logger.exception(f"Failed to ingest measure data published on {message.topic.value}")
+
+    async def _handle(self, message: Message):
+        topic = message.topic.value
+        try:
+            data = MeasureDataSchema.parse_raw(message.payload)
+        except ValidationError:
+            logger.warning(f"Dropping malformed measure data published on {topic}")
+            return
+
+        async with async_session() as session:
+            device = await verify_device_access_token(session, data.access_token)
+
+        if not device or not device.exists or device.device_id != self.get_topic_device_id(topic):
+            logger.warning(f"Dropping measure data with an invalid access token published on {topic}")
+            return
+
+        row = {
+            "device_id": device.device_id,
+            "value": data.value,
+            "timestamp": datetime.now(),
+        }
+        # Waiting for room in the buffer holds back this consumer, so the message queue absorbs the burst
+        await ingest_buffer.put(row)
+        publish_measure_data(device.garden_id, device.device_id, data.value, row["timestamp"])
+
+
+mqtt_publisher = MQTTPublisher(
+    broker_url=config.MQTT_BROKER_URL,
+    queue_size=config.MQTT_PUBLISH_QUEUE_SIZE,
+    reconnect_interval=config.MQTT_RECONNECT_INTERVAL,
+    max_reconnect_interval=config.MQTT_MAX_RECONNECT_INTERVAL,
+)
+
+mqtt_ingest_subscriber = MQTTIngestSubscriber(
+    broker_url=config.MQTT_BROKER_URL,
+    topic=config.MQTT_INGEST_TOPIC,
+    queue_size=config.MQTT_INGEST_QUEUE_SIZE,
+    reconnect_interval=config.MQTT_RECONNECT_INTERVAL,
+    max_reconnect_interval=config.MQTT_MAX_RECONNECT_INTERVAL,
+)
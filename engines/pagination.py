@@ -0,0 +1,72 @@
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from typing import Any, Callable, Sequence
+
+from fastapi import HTTPException, Query
+from sqlalchemy import Select
+from sqlalchemy.orm import InstrumentedAttribute
+from starlette import status
+
+import config
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))["id"]
+    except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError):
+        raise InvalidCursor(cursor)
+
+    if not isinstance(last_id, int):
+        raise InvalidCursor(cursor)
+
+    return last_id
+
+
+@dataclass(frozen=True)
+class PageParams:
+    # Id of the last item of the previous page, None for the first page
+    after_id: int | None
+    limit: int
+
+
+def get_page_params(
+    cursor: str | None = None,
+    limit: int = Query(config.PAGE_DEFAULT_LIMIT, ge=1, le=config.PAGE_MAX_LIMIT),
+) -> PageParams:
+    try:
+        after_id = decode_cursor(cursor) if cursor else None
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail={"detail": "Invalid cursor"})
+
+    return PageParams(after_id=after_id, limit=limit)
+
+
+def paginate(stmt: Select, id_column: InstrumentedAttribute, page: PageParams) -> Select:
+    """Keyset pagination on `id_column`; one extra row is fetched to know whether there is a next page"""
+    if page.after_id is not None:
+        stmt = stmt.where(id_column > page.after_id)
+
+    return stmt.order_by(id_column.asc()).limit(page.limit + 1)
+
+
+def get_page(
+    rows: Sequence,
+    limit: int,
+    get_id: Callable[[Any], int] = lambda row: row[0],
+) -> tuple[list, str | None]:
+    """Split rows fetched with `limit + 1` into the page and the cursor of the next one"""
+    if len(rows) <= limit:
+        return list(rows), None
+
+    rows = list(rows[:limit])
+    return rows, encode_cursor(get_id(rows[-1]))
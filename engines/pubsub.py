@@ -0,0 +1,98 @@
+import asyncio
+import json
+from contextlib import contextmanager
+from datetime import datetime
+from typing import AsyncIterator, Iterator
+
+import config
+
+
+class Subscription:
+    """Events of one garden for one subscriber.
+
+    The queue is bounded; when a subscriber falls behind, the oldest events
+    are dropped so that the publisher never waits on it.
+    """
+
+    def __init__(self, garden_id: int, max_size: int):
+        self.garden_id = garden_id
+        self.dropped = 0
+        self._queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=max_size)
+
+    def put(self, event: dict):
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+
+        self._queue.put_nowait(event)
+
+    async def get(self) -> dict:
+        return await self._queue.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        return await self.get()
+
+
+class PubSubHub:
+    """In-process fan-out of device events to the subscribers of their garden"""
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._subscriptions: dict[int, set[Subscription]] = {}
+
+    @property
+    def subscribers(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    @contextmanager
+    def subscribe(self, garden_id: int) -> Iterator[Subscription]:
+        subscription = Subscription(garden_id, self.queue_size)
+        self._subscriptions.setdefault(garden_id, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            subscriptions = self._subscriptions[garden_id]
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[garden_id]
+
+    def publish(self, garden_id: int, event: dict):
+        for subscription in self._subscriptions.get(garden_id, ()):
+            subscription.put(event)
+
+
+pubsub_hub = PubSubHub(queue_size=config.PUBSUB_QUEUE_SIZE)
+
+
+def publish_measure_data(garden_id: int, device_id: int, value: str, timestamp: datetime):
+    pubsub_hub.publish(garden_id, {
+        "type": "measure_data",
+        "device_id": device_id,
+        "value": value,
+        "timestamp": timestamp.isoformat(),
+    })
+
+
+def publish_lightbulb_state(garden_id: int, device_id: int, light_turned_on: bool):
+    pubsub_hub.publish(garden_id, {
+        "type": "lightbulb",
+        "device_id": device_id,
+        "light_turned_on": light_turned_on,
+    })
+
+
+async def stream_garden_events(garden_id: int, keepalive_interval: float) -> AsyncIterator[str]:
+    """Events of a garden encoded as Server-Sent Events, with a comment line
+    every `keepalive_interval` seconds of silence to keep proxies from closing the stream"""
+    with pubsub_hub.subscribe(garden_id) as subscription:
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), keepalive_interval)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
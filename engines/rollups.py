@@ -0,0 +1,305 @@
+from datetime import datetime, timedelta
+from typing import Iterable, Sequence
+
+from sqlalchemy import select, delete, func, literal
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from enums import DeviceDataGroupBy
+from models import MeasureDataModel, MeasureDataRollupModel
+
+RollupKey = tuple[int, DeviceDataGroupBy, datetime]
+
+
+def get_bucket(granularity: DeviceDataGroupBy, timestamp: datetime) -> datetime:
+    if granularity == DeviceDataGroupBy.HOUR:
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if granularity == DeviceDataGroupBy.DAY:
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def aggregate_rollups(
+    rows: Iterable[dict],
+    rollups: dict[RollupKey, list] | None = None,
+) -> dict[RollupKey, list]:
+    """Fold measure data rows into [count, sum, min, max] per (device, granularity, bucket).
+
+    Rows without a numeric_value are skipped.
+    """
+    rollups = {} if rollups is None else rollups
+
+    for row in rows:
+        value = row["numeric_value"]
+        if value is None:
+            continue
+
+        for granularity in DeviceDataGroupBy:
+            key = (row["device_id"], granularity, get_bucket(granularity, row["timestamp"]))
+            rollup = rollups.get(key)
+            if rollup is None:
+                rollups[key] = [1, value, value, value]
+            else:
+                rollup[0] += 1
+                rollup[1] += value
+                rollup[2] = min(rollup[2], value)
+                rollup[3] = max(rollup[3], value)
+
+    return rollups
+
+
+async def upsert_rollups(
+    session: AsyncSession,
+    rollups: dict[RollupKey, list],
+):
+    """Add the aggregated values to the stored rollups, without committing"""
+    if not rollups:
+        return
+
+    # Keep a stable lock order between concurrent flushes to avoid deadlocks
+    stmt = insert(MeasureDataRollupModel).values([
+        {
+            "device_id": device_id,
+            "granularity": granularity.value,
+            "bucket": bucket,
+            "value_count": value_count,
+            "value_sum": value_sum,
+            "value_min": value_min,
+            "value_max": value_max,
+        }
+        for (device_id, granularity, bucket), (value_count, value_sum, value_min, value_max)
+        in sorted(rollups.items(), key=lambda item: (item[0][0], item[0][1].value, item[0][2]))
+    ])
+    stmt = stmt.on_duplicate_key_update(
+        value_count=MeasureDataRollupModel.value_count + stmt.inserted.value_count,
+        value_sum=MeasureDataRollupModel.value_sum + stmt.inserted.value_sum,
+        value_min=func.least(MeasureDataRollupModel.value_min, stmt.inserted.value_min),
+        value_max=func.greatest(MeasureDataRollupModel.value_max, stmt.inserted.value_max),
+    )
+
+    await session.execute(stmt)
+
+
+async def upsert_measure_data_rollups(
+    session: AsyncSession,
+    rows: Sequence[dict],
+):
+    await upsert_rollups(session, aggregate_rollups(rows))
+
+
+def get_bucket_expression(granularity: DeviceDataGroupBy):
+    """SQL equivalent of get_bucket for MeasureDataModel.timestamp"""
+    bucket_formats = {
+        DeviceDataGroupBy.HOUR: "%Y-%m-%d %H:00:00",
+        DeviceDataGroupBy.DAY: "%Y-%m-%d 00:00:00",
+        DeviceDataGroupBy.MONTH: "%Y-%m-01 00:00:00",
+    }
+
+    return func.date_format(MeasureDataModel.timestamp, bucket_formats[granularity])
+
+
+ROLLUP_COLUMNS = ["device_id", "granularity", "bucket", "value_count", "value_sum", "value_min", "value_max"]
+ROLLUP_INSERT_CHUNK_SIZE = 1000
+
+
+def to_bucket(bucket: datetime | str) -> datetime:
+    # date_format() comes back as a string
+    return bucket if isinstance(bucket, datetime) else datetime.fromisoformat(bucket)
+
+
+async def _insert_rollup_rows(
+    session: AsyncSession,
+    rows: Sequence[tuple],
+    merge: bool = False,
+):
+    """Insert aggregated (ROLLUP_COLUMNS) rows with plain multi-row INSERTs.
+
+    The aggregates are read beforehand with a plain SELECT, which is a
+    non-locking consistent read; INSERT ... SELECT would take shared locks on
+    every scanned measure_datas row and block ingest for the whole rebuild.
+    With `merge`, a stored rollup is only overwritten by a row accounting for
+    more readings.
+    """
+    rows = sorted(rows, key=lambda row: (row[0], row[1], to_bucket(row[2])))
+    for i in range(0, len(rows), ROLLUP_INSERT_CHUNK_SIZE):
+        stmt = insert(MeasureDataRollupModel).values([
+            {**dict(zip(ROLLUP_COLUMNS, row)), "bucket": to_bucket(row[2])}
+            for row in rows[i:i + ROLLUP_INSERT_CHUNK_SIZE]
+        ])
+        if merge:
+            # value_count goes last since MySQL evaluates the assignments from left to right
+            more_complete = stmt.inserted.value_count > MeasureDataRollupModel.value_count
+            stmt = stmt.on_duplicate_key_update([
+                (column, func.if_(more_complete, stmt.inserted[column], MeasureDataRollupModel.__table__.c[column]))
+                for column in ("value_sum", "value_min", "value_max", "value_count")
+            ])
+        else:
+            stmt = stmt.on_duplicate_key_update([(column, stmt.inserted[column]) for column in ROLLUP_COLUMNS[3:]])
+
+        await session.execute(stmt)
+
+
+async def _rollup_raw_data(
+    session: AsyncSession,
+    granularity: DeviceDataGroupBy,
+    start: datetime,
+    end: datetime | None = None,
+    device_id: int | None = None,
+    merge: bool = False,
+):
+    """Replace the rollups of buckets in [start, end) with aggregates of the raw measure data.
+
+    With `merge`, existing rollups are not deleted and only get overwritten
+    when the raw data holds more readings than they do, which keeps the
+    operation safe to repeat after part of the raw data has been deleted.
+    """
+    delete_stmt = (
+        delete(MeasureDataRollupModel)
+        .where(MeasureDataRollupModel.granularity == granularity.value)
+        .where(MeasureDataRollupModel.bucket >= start)
+    )
+    bucket = get_bucket_expression(granularity)
+    stmt = (
+        select(
+            MeasureDataModel.device_id,
+            literal(granularity.value),
+            bucket,
+            func.count(MeasureDataModel.numeric_value),
+            func.sum(MeasureDataModel.numeric_value),
+            func.min(MeasureDataModel.numeric_value),
+            func.max(MeasureDataModel.numeric_value),
+        )
+        .where(MeasureDataModel.numeric_value.is_not(None))
+        .where(MeasureDataModel.timestamp >= start)
+        .group_by(MeasureDataModel.device_id, bucket)
+    )
+    if end is not None:
+        delete_stmt = delete_stmt.where(MeasureDataRollupModel.bucket < end)
+        stmt = stmt.where(MeasureDataModel.timestamp < end)
+    if device_id is not None:
+        delete_stmt = delete_stmt.where(MeasureDataRollupModel.device_id == device_id)
+        stmt = stmt.where(MeasureDataModel.device_id == device_id)
+
+    rows = (await session.execute(stmt)).tuples().all()
+    if not merge:
+        await session.execute(delete_stmt)
+
+    await _insert_rollup_rows(session, rows, merge=merge)
+
+
+async def _rollup_daily_rollups(
+    session: AsyncSession,
+    start: datetime,
+    end: datetime | None = None,
+    device_id: int | None = None,
+    merge: bool = False,
+):
+    """Replace the monthly rollups of months in [start, end) with aggregates of their daily rollups.
+
+    `merge` works like for _rollup_raw_data.
+    """
+    daily = aliased(MeasureDataRollupModel)
+    bucket = func.date_format(daily.bucket, "%Y-%m-01 00:00:00")
+
+    delete_stmt = (
+        delete(MeasureDataRollupModel)
+        .where(MeasureDataRollupModel.granularity == DeviceDataGroupBy.MONTH.value)
+        .where(MeasureDataRollupModel.bucket >= start)
+    )
+    stmt = (
+        select(
+            daily.device_id,
+            literal(DeviceDataGroupBy.MONTH.value),
+            bucket,
+            func.sum(daily.value_count),
+            func.sum(daily.value_sum),
+            func.min(daily.value_min),
+            func.max(daily.value_max),
+        )
+        .where(daily.granularity == DeviceDataGroupBy.DAY.value)
+        .where(daily.bucket >= start)
+        .group_by(daily.device_id, bucket)
+    )
+    if end is not None:
+        delete_stmt = delete_stmt.where(MeasureDataRollupModel.bucket < end)
+        stmt = stmt.where(daily.bucket < end)
+    if device_id is not None:
+        delete_stmt = delete_stmt.where(MeasureDataRollupModel.device_id == device_id)
+        stmt = stmt.where(daily.device_id == device_id)
+
+    rows = (await session.execute(stmt)).tuples().all()
+    if not merge:
+        await session.execute(delete_stmt)
+
+    await _insert_rollup_rows(session, rows, merge=merge)
+
+
+async def rebuild_day_rollups(
+    session: AsyncSession,
+    day: datetime,
+):
+    """Bring the hourly and daily rollups of one day up to date with its raw data, without committing.
+
+    Rollups that already account for more readings than the raw data are
+    kept, so this is safe to run on a day whose raw data was partially deleted.
+    """
+    start = get_bucket(DeviceDataGroupBy.DAY, day)
+    end = start + timedelta(days=1)
+
+    await _rollup_raw_data(session, DeviceDataGroupBy.HOUR, start, end, merge=True)
+    await _rollup_raw_data(session, DeviceDataGroupBy.DAY, start, end, merge=True)
+
+
+async def rebuild_month_rollups(
+    session: AsyncSession,
+    month: datetime,
+):
+    """Recompute the monthly rollups of one month from its daily rollups, without committing"""
+    start = get_bucket(DeviceDataGroupBy.MONTH, month)
+    end = (start + timedelta(days=32)).replace(day=1)
+
+    await _rollup_daily_rollups(session, start, end)
+
+
+async def rebuild_rollups(
+    session: AsyncSession,
+    device_id: int | None = None,
+    now: datetime | None = None,
+):
+    """Recompute rollups from measure_datas, for one device or all of them.
+
+    Hourly and daily rollups are rebuilt from the oldest raw reading still
+    stored, so buckets whose raw data was compacted away are kept. Monthly
+    rollups are always derived from the daily ones. The aggregation runs in
+    the database with a plain SELECT, and everything is written in a single
+    transaction.
+
+    Rollups are read, then deleted and rewritten, so increments made by
+    ingest in between would be lost. Ingest only keeps writing to the current
+    day and month, so those are merged instead of replaced: they are only
+    corrected when the raw data holds more readings than they do. Readings
+    of older days saved while this runs may still be lost; stop ingest for an
+    exact rebuild.
+    """
+    stmt = select(func.min(MeasureDataModel.timestamp))
+    if device_id is not None:
+        stmt = stmt.where(MeasureDataModel.device_id == device_id)
+
+    oldest = (await session.execute(stmt)).scalar()
+    if oldest is not None:
+        today = get_bucket(DeviceDataGroupBy.DAY, now or datetime.now())
+        this_month = get_bucket(DeviceDataGroupBy.MONTH, today)
+        start = get_bucket(DeviceDataGroupBy.DAY, oldest)
+        month_start = get_bucket(DeviceDataGroupBy.MONTH, oldest)
+
+        for granularity in (DeviceDataGroupBy.HOUR, DeviceDataGroupBy.DAY):
+            if start < today:
+                await _rollup_raw_data(session, granularity, start, today, device_id=device_id)
+            await _rollup_raw_data(session, granularity, max(start, today), device_id=device_id, merge=True)
+
+        if month_start < this_month:
+            await _rollup_daily_rollups(session, month_start, this_month, device_id=device_id)
+        await _rollup_daily_rollups(session, max(month_start, this_month), device_id=device_id, merge=True)
+
+    await session.commit()
@@ -14,6 +14,12 @@ class DeviceStatus(str, Enum):
     ERROR = 'error'
 
 
+class DeviceCategory(str, Enum):
+    SENSOR = 'sensor'
+    ACTUATOR = 'actuator'
+    LIGHTBULB = 'lightbulb'
+
+
 class DeviceDataGroupBy(str, Enum):
     HOUR = 'hour'
     DAY = 'day'
@@ -22,4 +28,18 @@ class DeviceDataGroupBy(str, Enum):
 
 class DeviceTriggerAction(str, Enum):
     TURN_ON = 'turn_on'
-    TURN_OFF = 'turn_off'
\ No newline at end of file
+    TURN_OFF = 'turn_off'
+
+
+class MeasureDataExportFormat(str, Enum):
+    NDJSON = 'ndjson'
+    CSV = 'csv'
+
+
+class DeviceHistoryStatistic(str, Enum):
+    COUNT = 'count'
+    MEAN = 'mean'
+    MIN = 'min'
+    MAX = 'max'
+    MEDIAN = 'median'
+    P95 = 'p95'
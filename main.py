@@ -1,9 +1,10 @@
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException
-from elasticsearch import Elasticsearch
+from elasticsearch import AsyncElasticsearch
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
+from loguru import logger
 from pydantic import ValidationError
 from starlette import status
 from starlette.middleware.cors import CORSMiddleware
@@ -11,6 +12,18 @@ from starlette.responses import JSONResponse
 
 import config # noqa
 from controllers.routers import routers as public_routers
+from db import engine
+from engines import metrics
+from engines.catalog import catalog_cache
+from engines.compaction import compaction_worker
+from engines.devices import device_token_cache
+from engines.device_tokens import device_token_issuer
+from engines.elasticsearch import measure_data_indexer
+from engines.heartbeats import heartbeat_recorder
+from engines.history import history_cache
+from engines.ingest import ingest_buffer
+from engines.mqtt import mqtt_publisher, mqtt_ingest_subscriber, MQTTPublisherBusy
+from engines.pubsub import pubsub_hub
 
 
 def create_http_exception_detail(message: str, detail: list[dict] = None) -> dict:
@@ -22,16 +35,57 @@ def create_http_exception_detail(message: str, detail: list[dict] = None) -> dic
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    app.elk_client = Elasticsearch(
+    app.elk_client = AsyncElasticsearch(
         config.ELASTICSEARCH_URL,
         api_key=config.ELASTICSEARCH_API_KEY,
     )
+    await measure_data_indexer.start(app.elk_client)
+    await ingest_buffer.start()
+    await heartbeat_recorder.start()
+    await mqtt_publisher.start()
+    if config.MQTT_INGEST_ENABLED:
+        await mqtt_ingest_subscriber.start()
+    if config.COMPACTION_ENABLED:
+        await compaction_worker.start()
     yield
+    await compaction_worker.stop()
+    await mqtt_ingest_subscriber.stop()
+    await mqtt_publisher.stop()
+    await heartbeat_recorder.stop()
+    await ingest_buffer.stop()
+    await measure_data_indexer.stop()
     await app.elk_client.close()
 
-app = FastAPI(lìfespan=lifespan)
+app = FastAPI(lifespan=lifespan)
 app.include_router(public_routers)
 
+if config.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+    metrics.instrument_engine(engine)
+    metrics.register_caches({
+        "device_token_resolution": device_token_cache,
+        "device_token_issuance": device_token_issuer.cache,
+        "history": history_cache,
+        "catalog_gardens": catalog_cache.gardens,
+        "catalog_device_types": catalog_cache.device_types,
+        "catalog_devices": catalog_cache.devices,
+    })
+    metrics.register_gauge("ingest_buffer_queued", "Measure data rows waiting to be written", lambda: ingest_buffer.queued)
+    metrics.register_gauge(
+        "ingest_buffer_dropped", "Measure data rows dropped after failing to be written",
+        lambda: ingest_buffer.dropped,
+    )
+    metrics.register_gauge(
+        "elasticsearch_indexer_queued", "Measure data rows waiting to be indexed", lambda: measure_data_indexer.queued,
+    )
+    metrics.register_gauge(
+        "elasticsearch_indexer_dropped",
+        "Measure data rows dropped by a full indexing queue or after failing to be indexed",
+        lambda: measure_data_indexer.dropped,
+    )
+    metrics.register_gauge("mqtt_publisher_queued", "MQTT messages waiting to be published", lambda: mqtt_publisher.queued)
+    metrics.register_gauge("pubsub_subscribers", "Connected dashboard event subscribers", lambda: pubsub_hub.subscribers)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -43,7 +97,7 @@ app.add_middleware(
 
 @app.exception_handler(ValidationError)
 async def validation_exception_handler(request, exc):
-    print(exc.errors())
+    logger.warning(f"Can not process entity: {exc.errors()}")
     return JSONResponse(
         status_code=422, content=create_http_exception_detail(message=f"Can not process entity. {exc.errors()}", detail=exc.errors())
     )
@@ -53,12 +107,20 @@ async def validation_exception_handler(request, exc):
 async def validation_exception_handler(request, exc: RequestValidationError):
 
     exc_str = f'{exc}'.replace('\n', ' ').replace('   ', ' ')
-    # or logger.error(f'{exc}')
-    print(exc_str)
+    logger.warning(f"Invalid request: {exc_str}")
     content = {'status_code': 10422, 'message': exc_str, 'data': None}
     return JSONResponse(content=content, status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
 
 
+@app.exception_handler(MQTTPublisherBusy)
+async def mqtt_publisher_busy_handler(request, exc: MQTTPublisherBusy):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content=jsonable_encoder({"detail": "Lightbulb command queue is full, retry later"}),
+        headers={"Retry-After": "1"},
+    )
+
+
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc: HTTPException):
     return JSONResponse(status_code=exc.status_code, content=exc.detail)
@@ -66,6 +128,7 @@ async def http_exception_handler(request, exc: HTTPException):
 
 @app.exception_handler(Exception)
 async def exception_handler(request, exc):
+    logger.opt(exception=exc).error(f"Unhandled error on {request.method} {request.url.path}")
     return JSONResponse(
         status_code=500,
         content=jsonable_encoder(create_http_exception_detail(message="Server Error.")),
@@ -2,3 +2,5 @@ from .devices import DeviceModel
 from .device_types import DeviceTypeModel
 from .gardens import GardenModel
 from .measure_data import MeasureDataModel
+from .device_latest_reading import DeviceLatestReadingModel
+from .measure_data_rollup import MeasureDataRollupModel
@@ -0,0 +1,16 @@
+from datetime import datetime
+
+from sqlalchemy import Integer, String, DateTime
+from sqlalchemy.orm import Mapped, mapped_column
+
+from db import Base
+
+
+class DeviceLatestReadingModel(Base):
+    """Latest measure data of each device, kept in sync on ingest"""
+
+    __tablename__ = "device_latest_readings"
+
+    device_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    value: Mapped[str] = mapped_column(String(256), nullable=False)
+    timestamp: Mapped[datetime] = mapped_column(DateTime, nullable=False)
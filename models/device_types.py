@@ -2,6 +2,7 @@ from sqlalchemy import Integer, String
 from sqlalchemy.orm import mapped_column, Mapped
 
 from db import Base
+from enums import DeviceCategory
 from models.base import DateTimeMixin
 
 
@@ -10,5 +11,8 @@ class DeviceTypeModel(Base, DateTimeMixin):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     name: Mapped[str] = mapped_column(String(256), nullable=False)
+    category: Mapped[DeviceCategory] = mapped_column(
+        String(32), nullable=False, default=DeviceCategory.SENSOR, index=True,
+    )
     measure_data_name: Mapped[str] = mapped_column(String(128), default="")
     unit: Mapped[str] = mapped_column(String(32))
@@ -1,4 +1,3 @@
-import jwt
 from sqlalchemy import Integer, String, Text, ForeignKey, DateTime, JSON
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -29,18 +28,11 @@ class DeviceModel(Base, DateTimeMixin):
     def device_type(self) -> str:
         return self.device_type_model.name
 
-    @property
-    def access_token(self) -> str:
-        payload = {
-            "device_id": self.id
-        }
-        # Generate the JWT token
-        return jwt.encode(payload, "secret_key", algorithm='HS256')
-
     @property
     def light_turned_on(self) -> str:
         return self.meta_data.get('light_turned_on', False)
 
     @light_turned_on.setter
     def light_turned_on(self, light_turned_on: bool):
-        self.meta_data['light_turned_on'] = light_turned_on
+        # Assign a new dict, in-place changes of a JSON column aren't tracked by the session
+        self.meta_data = {**(self.meta_data or {}), 'light_turned_on': light_turned_on}
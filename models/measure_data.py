@@ -1,6 +1,7 @@
 from datetime import datetime
 
-from sqlalchemy import Integer, String, DateTime
+from sqlalchemy import Integer, String, DateTime, Double, Index, func, cast
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import Mapped, mapped_column
 
 from db import Base
@@ -9,8 +10,26 @@ from models.base import DateTimeMixin
 
 class MeasureDataModel(Base, DateTimeMixin):
     __tablename__ = "measure_datas"
+    __table_args__ = (
+        Index("ix_measure_datas_device_id_timestamp", "device_id", "timestamp"),
+        # Range scans over every device (rollup rebuilds, compaction)
+        Index("ix_measure_datas_timestamp", "timestamp"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     device_id: Mapped[int] = mapped_column(Integer, nullable=False)
     timestamp: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now())
-    value: Mapped[str] = mapped_column(String(256), nullable=False)
+    numeric_value: Mapped[float | None] = mapped_column(Double, nullable=True)
+    # Raw payload, only kept when it is not a number
+    value: Mapped[str | None] = mapped_column(String(256), nullable=True)
+
+    @hybrid_property
+    def display_value(self) -> str:
+        if self.value is not None:
+            return self.value
+        return format(self.numeric_value, ".15g")
+
+    @display_value.inplace.expression
+    @classmethod
+    def _display_value_expression(cls):
+        return func.coalesce(cls.value, cast(cls.numeric_value, String))
@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from sqlalchemy import Integer, String, DateTime, Double
+from sqlalchemy.orm import Mapped, mapped_column
+
+from db import Base
+from enums import DeviceDataGroupBy
+
+
+class MeasureDataRollupModel(Base):
+    """Count, sum, min and max of a device numeric measure data per hour, day or month bucket"""
+
+    __tablename__ = "measure_data_rollups"
+
+    device_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    granularity: Mapped[DeviceDataGroupBy] = mapped_column(String(16), primary_key=True)
+    bucket: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    value_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    value_sum: Mapped[float] = mapped_column(Double, nullable=False)
+    value_min: Mapped[float] = mapped_column(Double, nullable=False)
+    value_max: Mapped[float] = mapped_column(Double, nullable=False)
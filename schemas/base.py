@@ -1,6 +1,17 @@
+from typing import Generic, TypeVar
+
 from pydantic import ConfigDict, BaseModel
+from pydantic.generics import GenericModel
 
 
 class ORMModel(BaseModel):
     class Config:
         orm_mode = True
+
+
+T = TypeVar("T")
+
+
+class PageSchema(GenericModel, Generic[T]):
+    items: list[T]
+    next_cursor: str | None
@@ -1,19 +1,23 @@
 from pydantic import BaseModel
 
+from enums import DeviceCategory
 from schemas.base import ORMModel
 
 
 class DeviceTypeSchema(ORMModel):
     id: int
     name: str
+    category: DeviceCategory
     unit: str | None
 
 
 class CreateDeviceTypeSchema(BaseModel):
     name: str
+    category: DeviceCategory = DeviceCategory.SENSOR
     unit: str | None
 
 
 class UpdateDeviceTypeSchema(BaseModel):
     name: str | None
+    category: DeviceCategory | None
     unit: str | None
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from pydantic import BaseModel
 
 from enums import DeviceStatus, DeviceTriggerAction
@@ -12,6 +14,7 @@ class DeviceSchema(ORMModel):
     device_type: str
     status: DeviceStatus
     access_token: str
+    last_ping: datetime | None
     latest_measure_data: str
 
 
@@ -23,12 +26,14 @@ class LightbulbDeviceSchema(ORMModel):
     device_type: str
     status: DeviceStatus
     access_token: str
+    last_ping: datetime | None
     light_turned_on: bool
 
 
 class DeviceHistoryItemSchema(BaseModel):
     timestamp: str
-    value: str
+    # None for buckets without readings, except for the count and mean statistics
+    value: str | None
 
 
 class DeviceHistorySchema(BaseModel):
@@ -37,6 +42,10 @@ class DeviceHistorySchema(BaseModel):
     values: list[DeviceHistoryItemSchema]
 
 
+class GardenDeviceHistorySchema(DeviceHistorySchema):
+    device_id: int
+
+
 class CreateDeviceSchema(BaseModel):
     title: str
     description: str
@@ -57,3 +66,13 @@ class PingDeviceSchema(BaseModel):
 
 class TriggerActionSchema(BaseModel):
     action: DeviceTriggerAction
+
+
+class BulkTriggerActionSchema(TriggerActionSchema):
+    # Every lightbulb of the garden when not given
+    device_ids: list[int] | None
+
+
+class LightbulbStateSchema(BaseModel):
+    device_id: int
+    light_turned_on: bool
@@ -1,8 +1,30 @@
 from datetime import datetime
 
-from pydantic import BaseModel
+from pydantic import BaseModel, conlist
+
+import config
 
 
 class MeasureDataSchema(BaseModel):
     access_token: str
     value: str
+
+
+class MeasureDataBatchItemSchema(MeasureDataSchema):
+    timestamp: datetime | None
+
+
+class MeasureDataBatchSchema(BaseModel):
+    items: conlist(MeasureDataBatchItemSchema, min_items=1, max_items=config.MEASURE_DATA_BATCH_MAX_SIZE)
+
+
+class MeasureDataBatchItemResultSchema(BaseModel):
+    index: int
+    success: bool
+    detail: str
+
+
+class MeasureDataBatchResultSchema(BaseModel):
+    received: int
+    failed: int
+    items: list[MeasureDataBatchItemResultSchema]
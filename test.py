@@ -1,9 +1,15 @@
 from sqlalchemy.dialects import mysql
-from sqlalchemy.sql.ddl import CreateTable
+from sqlalchemy.sql.ddl import CreateTable, CreateIndex
 
 from models import *
 
 print(CreateTable(DeviceModel.__table__).compile(dialect=mysql.dialect()))
 print(CreateTable(GardenModel.__table__).compile(dialect=mysql.dialect()))
 print(CreateTable(DeviceTypeModel.__table__).compile(dialect=mysql.dialect()))
+for index in DeviceTypeModel.__table__.indexes:
+    print(CreateIndex(index).compile(dialect=mysql.dialect()))
 print(CreateTable(MeasureDataModel.__table__).compile(dialect=mysql.dialect()))
+for index in MeasureDataModel.__table__.indexes:
+    print(CreateIndex(index).compile(dialect=mysql.dialect()))
+print(CreateTable(DeviceLatestReadingModel.__table__).compile(dialect=mysql.dialect()))
+print(CreateTable(MeasureDataRollupModel.__table__).compile(dialect=mysql.dialect()))
@@ -0,0 +1,59 @@
+from datetime import datetime
+
+import numpy as np
+
+from engines.archive import MeasureDataArchive
+
+
+def read_all(archive: MeasureDataArchive, device_id: int = 1) -> list[tuple[datetime, float]]:
+    timestamps, values = archive.read(device_id, datetime(2024, 1, 1), datetime(2024, 12, 31, 23, 59))
+    return list(zip(timestamps.astype(datetime), values.tolist()))
+
+
+def test_append_and_read_back(tmp_path):
+    archive = MeasureDataArchive(str(tmp_path))
+
+    assert archive.append(1, [(datetime(2024, 1, 1, 1), 1.0), (datetime(2024, 1, 1, 2), 2.0)]) == 2
+
+    assert read_all(archive) == [(datetime(2024, 1, 1, 1), 1.0), (datetime(2024, 1, 1, 2), 2.0)]
+
+
+def test_late_readings_are_merged_in_order(tmp_path):
+    archive = MeasureDataArchive(str(tmp_path))
+    archive.append(1, [(datetime(2024, 1, 1, 1), 1.0), (datetime(2024, 1, 1, 3), 3.0)])
+
+    # Compaction deletes what it archived, so a late reading must not be dropped here
+    assert archive.append(1, [(datetime(2024, 1, 1, 2), 2.0)]) == 1
+
+    assert read_all(archive) == [
+        (datetime(2024, 1, 1, 1), 1.0),
+        (datetime(2024, 1, 1, 2), 2.0),
+        (datetime(2024, 1, 1, 3), 3.0),
+    ]
+
+
+def test_archiving_a_day_again_is_harmless(tmp_path):
+    archive = MeasureDataArchive(str(tmp_path))
+    rows = [(datetime(2024, 1, 1, 1), 1.0), (datetime(2024, 1, 1, 2), 2.0)]
+    archive.append(1, rows)
+
+    assert archive.append(1, rows) == 0
+
+    assert len(read_all(archive)) == 2
+
+
+def test_reads_span_months_and_respect_bounds(tmp_path):
+    archive = MeasureDataArchive(str(tmp_path))
+    archive.append(1, [(datetime(2024, 1, 31, 23), 1.0), (datetime(2024, 2, 1, 1), 2.0), (datetime(2024, 2, 2), 3.0)])
+
+    timestamps, values = archive.read(1, datetime(2024, 1, 31), datetime(2024, 2, 1, 23))
+
+    assert values.tolist() == [1.0, 2.0]
+    assert timestamps.dtype == np.dtype("datetime64[us]")
+
+
+def test_devices_are_archived_separately(tmp_path):
+    archive = MeasureDataArchive(str(tmp_path))
+    archive.append(1, [(datetime(2024, 1, 1, 1), 1.0)])
+
+    assert read_all(archive, device_id=2) == []
@@ -0,0 +1,12 @@
+from datetime import datetime
+
+from engines.compaction import RetentionPolicy
+
+
+def test_retention_cutoffs_are_day_aligned():
+    policy = RetentionPolicy(raw_days=7, hourly_rollup_days=30)
+
+    raw_cutoff, hourly_cutoff = policy.get_cutoffs(datetime(2024, 3, 31, 15, 30))
+
+    assert raw_cutoff == datetime(2024, 3, 24)
+    assert hourly_cutoff == datetime(2024, 3, 1)
@@ -0,0 +1,80 @@
+import jwt
+import pytest
+from sqlalchemy import delete
+
+from engines.device_tokens import device_token_issuer
+from engines.devices import verify_device_access_token
+from enums import DeviceStatus
+from models import DeviceModel
+
+
+@pytest.fixture
+def verify(db):
+    async def verify(access_token: str):
+        async with db() as session:
+            return await verify_device_access_token(session, access_token)
+
+    return verify
+
+
+async def test_tokens_resolve_to_their_device(client, verify):
+    entry = await verify(device_token_issuer.issue(1))
+
+    assert (entry.device_id, entry.status, entry.garden_id) == (1, DeviceStatus.SETUP, 1)
+
+
+async def test_invalid_tokens_are_not_resolved(client, verify):
+    assert await verify("not a token") is None
+
+
+async def test_resolved_tokens_are_served_from_the_cache(client, db, verify):
+    await verify(device_token_issuer.issue(1))
+    async with db() as session:
+        await session.execute(delete(DeviceModel).where(DeviceModel.id == 1))
+        await session.commit()
+
+    assert (await verify(device_token_issuer.issue(1))).exists
+
+
+async def test_creating_a_device_drops_its_cached_token(client, verify):
+    assert not (await verify(device_token_issuer.issue(3))).exists
+
+    response = client.post("/devices", json={
+        "title": "Hygrometer", "description": "", "device_type_id": 1, "garden_id": 1,
+    })
+
+    assert response.json()["id"] == 3
+    assert (await verify(device_token_issuer.issue(3))).exists
+
+
+async def test_updating_a_device_drops_its_cached_token(client, verify):
+    await verify(device_token_issuer.issue(1))
+
+    client.put("/devices/1", json={"status": "active"})
+
+    assert (await verify(device_token_issuer.issue(1))).status == DeviceStatus.ACTIVE
+
+
+async def test_deleting_a_device_drops_its_cached_token(client, verify):
+    await verify(device_token_issuer.issue(1))
+
+    client.delete("/devices/1")
+
+    assert not (await verify(device_token_issuer.issue(1))).exists
+
+
+async def test_tokens_signed_differently_are_accepted_and_invalidated(client, verify):
+    # Same device and key as the issued token, but the device id is a string
+    access_token = jwt.encode({"device_id": "1"}, device_token_issuer.secret_key, algorithm=device_token_issuer.algorithm)
+    assert access_token != device_token_issuer.issue(1)
+    assert (await verify(access_token)).exists
+
+    client.delete("/devices/1")
+
+    assert not (await verify(access_token)).exists
+
+
+def test_updating_an_unknown_device_is_not_found(client):
+    response = client.put("/devices/99", json={"status": "active"})
+
+    assert response.status_code == 404
@@ -0,0 +1,123 @@
+import asyncio
+
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig
+from elasticsearch import ApiError
+from elasticsearch import ConnectionError as ElasticsearchConnectionError
+
+from engines.elasticsearch import MeasureDataIndexer
+
+
+def api_error(status: int) -> ApiError:
+    meta = ApiResponseMeta(
+        status=status, http_version="1.1", headers=HttpHeaders(), duration=0, node=NodeConfig("http", "localhost", 9200),
+    )
+    return ApiError(f"status {status}", meta, {})
+
+
+class FakeElasticsearch:
+    """Answers bulk requests from `responses`: an exception to raise or a response body"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    async def bulk(self, operations):
+        self.requests.append(operations)
+        response = self.responses.pop(0) if self.responses else {"errors": False, "items": []}
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def make_indexer(max_size: int = 100) -> MeasureDataIndexer:
+    return MeasureDataIndexer(
+        index_prefix="measure-data",
+        max_retries=3,
+        retry_backoff=0,
+        max_size=max_size,
+        flush_size=10,
+        flush_interval=0.01,
+    )
+
+
+async def index(client: FakeElasticsearch, *batches: list[dict]) -> MeasureDataIndexer:
+    indexer = make_indexer()
+
+    await indexer.start(client)
+    for rows in batches:
+        indexer.enqueue(rows)
+        await asyncio.sleep(0.05)
+    await indexer.stop()
+
+    return indexer
+
+
+async def test_rows_go_to_monthly_indices(make_row):
+    client = FakeElasticsearch()
+
+    await index(client, [make_row()])
+
+    action, document = client.requests[0]
+    assert action == {"index": {"_index": "measure-data-2024.01"}}
+    assert document["device_id"] == 1
+    assert document["numeric_value"] == 21.5
+
+
+async def test_connection_errors_and_server_errors_are_retried(make_row):
+    client = FakeElasticsearch(ElasticsearchConnectionError("down"), api_error(503))
+
+    await index(client, [make_row()])
+
+    assert len(client.requests) == 3
+
+
+async def test_client_errors_are_not_retried(make_row):
+    client = FakeElasticsearch(api_error(400))
+
+    indexer = await index(client, [make_row()])
+
+    assert len(client.requests) == 1
+    assert indexer.dropped == 0
+
+
+async def test_only_retryable_items_are_sent_again(make_row):
+    client = FakeElasticsearch({
+        "errors": True,
+        "items": [
+            {"index": {"status": 201}},
+            {"index": {"status": 429, "error": {"type": "es_rejected_execution_exception"}}},
+            {"index": {"status": 400, "error": {"type": "mapper_parsing_exception"}}},
+        ],
+    })
+
+    await index(client, [make_row(1), make_row(2), make_row(3)])
+
+    assert len(client.requests) == 2
+    assert [document["device_id"] for document in client.requests[1][1::2]] == [2]
+
+
+async def test_rows_are_dropped_after_the_last_retry(make_row):
+    client = FakeElasticsearch(*[api_error(503)] * 4)
+
+    indexer = await index(client, [make_row(1), make_row(2)])
+
+    assert len(client.requests) == 4
+    assert indexer.dropped == 2
+
+
+async def test_worker_survives_unexpected_errors(make_row):
+    client = FakeElasticsearch(RuntimeError("unexpected"))
+
+    await index(client, [make_row(1)], [make_row(2)])
+
+    assert [request[1]["device_id"] for request in client.requests] == [1, 1, 2]
+
+
+async def test_rows_are_dropped_when_the_queue_is_full(make_row):
+    indexer = make_indexer(max_size=2)
+
+    await indexer.start(FakeElasticsearch())
+    indexer.enqueue([make_row(), make_row(), make_row()])
+    await indexer.stop()
+
+    assert indexer.dropped == 1
@@ -0,0 +1,64 @@
+from datetime import datetime
+
+import pytest
+
+import engines.heartbeats
+from engines.heartbeats import HeartbeatRecorder
+from models import DeviceModel
+
+
+@pytest.fixture
+def recorder(db, monkeypatch):
+    monkeypatch.setattr(engines.heartbeats, "async_session", db)
+    return HeartbeatRecorder(flush_interval=60)
+
+
+async def get_stored_last_ping(db, device_id: int) -> datetime | None:
+    async with db() as session:
+        return (await session.get(DeviceModel, device_id)).last_ping
+
+
+async def test_only_the_latest_ping_of_a_device_is_written(recorder, db):
+    recorder.record(1, datetime(2024, 1, 15, 12))
+    recorder.record(1, datetime(2024, 1, 15, 12, 5))
+    recorder.record(2, datetime(2024, 1, 15, 12, 1))
+
+    await recorder.flush()
+
+    assert await get_stored_last_ping(db, 1) == datetime(2024, 1, 15, 12, 5)
+    assert await get_stored_last_ping(db, 2) == datetime(2024, 1, 15, 12, 1)
+
+
+async def test_unflushed_pings_are_visible(recorder):
+    recorder.record(1, datetime(2024, 1, 15, 12, 5))
+
+    assert recorder.get_last_ping(1, datetime(2024, 1, 15, 12)) == datetime(2024, 1, 15, 12, 5)
+    assert recorder.get_last_ping(2, datetime(2024, 1, 15, 12)) == datetime(2024, 1, 15, 12)
+
+
+async def test_failed_flush_keeps_pings_unless_the_device_pinged_again(recorder, db, monkeypatch):
+    recorder.record(1, datetime(2024, 1, 15, 12))
+    recorder.record(2, datetime(2024, 1, 15, 12))
+
+    async def write(session, pings):
+        recorder.record(2, datetime(2024, 1, 15, 12, 5))
+        raise RuntimeError("database is down")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(recorder, "_write", write)
+        await recorder.flush()
+
+    assert recorder.get_last_ping(1, None) == datetime(2024, 1, 15, 12)
+    await recorder.flush()
+    assert await get_stored_last_ping(db, 1) == datetime(2024, 1, 15, 12)
+    assert await get_stored_last_ping(db, 2) == datetime(2024, 1, 15, 12, 5)
+
+
+async def test_stop_flushes_pending_pings(recorder, db):
+    await recorder.start()
+    recorder.record(1, datetime(2024, 1, 15, 12))
+
+    await recorder.stop()
+
+    assert not recorder.running
+    assert await get_stored_last_ping(db, 1) == datetime(2024, 1, 15, 12)
@@ -0,0 +1,43 @@
+from datetime import datetime
+
+import pytest
+
+from engines.history import get_device_history_values, history_cache, invalidate_history_cache
+from enums import DeviceDataGroupBy, DeviceHistoryStatistic
+
+DAY = datetime(2024, 1, 15)
+CACHE_KEY = (1, DeviceDataGroupBy.HOUR, DAY, DeviceHistoryStatistic.MEAN)
+
+
+class WrittenDuringRead:
+    """Session on which a reading of device 1 is saved while the history query runs"""
+
+    def __init__(self, session):
+        self.session = session
+
+    async def execute(self, *args, **kwargs):
+        invalidate_history_cache([{"device_id": 1, "timestamp": DAY}])
+        return await self.session.execute(*args, **kwargs)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    history_cache.clear()
+
+
+async def test_history_is_cached_until_a_reading_lands_in_the_period(db):
+    async with db() as session:
+        values = await get_device_history_values(session, 1, DeviceDataGroupBy.HOUR, DAY)
+
+    assert history_cache.get(CACHE_KEY) == values
+
+    invalidate_history_cache([{"device_id": 1, "timestamp": DAY.replace(hour=12)}])
+
+    assert history_cache.get(CACHE_KEY) is None
+
+
+async def test_history_read_during_a_write_is_not_cached(db):
+    async with db() as session:
+        await get_device_history_values(WrittenDuringRead(session), 1, DeviceDataGroupBy.HOUR, DAY)
+
+    assert history_cache.get(CACHE_KEY) is None
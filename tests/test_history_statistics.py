@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import engines.archive
+import engines.history
+from engines.archive import MeasureDataArchive, to_datetime64
+from engines.history import aggregate_series, get_device_history_values, get_quantile_statement, history_cache
+from engines.rollups import to_bucket
+from enums import DeviceDataGroupBy, DeviceHistoryStatistic
+from models import MeasureDataModel
+
+DAY = datetime(2024, 1, 15)
+
+
+def make_readings(seed: int = 0) -> tuple[list[datetime], list[float]]:
+    """Time ordered readings of one day, with hours of one, two and many readings and some empty ones"""
+    random = np.random.default_rng(seed)
+    timestamps = [DAY.replace(hour=1), DAY.replace(hour=2), DAY.replace(hour=2, minute=30)]
+    timestamps += sorted(DAY + timedelta(hours=5, seconds=int(second)) for second in random.integers(0, 14 * 3600, 200))
+    return timestamps, random.normal(20, 5, len(timestamps)).round(3).tolist()
+
+
+def expected(timestamps: list[datetime], values: list[float], reduce) -> dict[datetime, float]:
+    by_hour = {}
+    for timestamp, value in zip(timestamps, values):
+        by_hour.setdefault(timestamp.replace(minute=0, second=0), []).append(value)
+    return {hour: float(reduce(np.array(hour_values))) for hour, hour_values in by_hour.items()}
+
+
+@pytest.mark.parametrize("statistic, reduce", [
+    (DeviceHistoryStatistic.COUNT, len),
+    (DeviceHistoryStatistic.MEAN, np.mean),
+    (DeviceHistoryStatistic.MIN, np.min),
+    (DeviceHistoryStatistic.MAX, np.max),
+    (DeviceHistoryStatistic.MEDIAN, np.median),
+    (DeviceHistoryStatistic.P95, lambda values: np.quantile(values, 0.95)),
+])
+def test_series_statistics_match_numpy(statistic, reduce):
+    timestamps, values = make_readings()
+
+    result = aggregate_series(DeviceDataGroupBy.HOUR, DAY, to_datetime64(timestamps), np.array(values), statistic)
+
+    assert result == pytest.approx(expected(timestamps, values, reduce))
+
+
+@pytest.mark.parametrize("q", [0.5, 0.95])
+async def test_sql_quantiles_match_numpy(db, q):
+    timestamps, values = make_readings()
+    async with db() as session:
+        session.add_all([
+            MeasureDataModel(device_id=1, timestamp=timestamp, numeric_value=value)
+            for timestamp, value in zip(timestamps, values)
+        ])
+        session.add(MeasureDataModel(device_id=1, timestamp=DAY.replace(hour=3), value="on"))
+        await session.commit()
+
+        stmt = get_quantile_statement([1], DeviceDataGroupBy.HOUR, DAY, DAY.replace(hour=23, minute=59), q)
+        rows = (await session.execute(stmt)).tuples().all()
+
+    result = {to_bucket(bucket): value for _, bucket, value in rows}
+    assert result == pytest.approx(expected(timestamps, values, lambda hour_values: np.quantile(hour_values, q)))
+
+
+class FixedRetentionPolicy:
+    def __init__(self, raw_cutoff: datetime, hourly_cutoff: datetime):
+        self.cutoffs = raw_cutoff, hourly_cutoff
+
+    def get_cutoffs(self, now: datetime) -> tuple[datetime, datetime]:
+        return self.cutoffs
+
+
+async def test_only_buckets_before_the_raw_cutoff_are_read_from_the_archive(db, tmp_path, monkeypatch):
+    archive = MeasureDataArchive(str(tmp_path))
+    archive.append(1, [(datetime(2024, 1, 10, hour), float(hour)) for hour in (1, 2, 3)])
+    monkeypatch.setattr(engines.archive, "measure_data_archive", archive)
+    monkeypatch.setattr(engines.history, "measure_data_archive", archive)
+    policy = FixedRetentionPolicy(raw_cutoff=datetime(2024, 1, 16), hourly_cutoff=datetime(2023, 1, 1))
+    monkeypatch.setattr(engines.history, "retention_policy", policy)
+
+    loaded = []
+    load_devices_series = engines.history.load_devices_series
+
+    async def spy(session, device_ids, start, end):
+        loaded.append((start, end))
+        return await load_devices_series(session, device_ids, start, end)
+
+    monkeypatch.setattr(engines.history, "load_devices_series", spy)
+    history_cache.clear()
+
+    async with db() as session:
+        session.add_all([
+            # A late reading of an archived day, and readings of a day that is not archived yet
+            MeasureDataModel(device_id=1, timestamp=datetime(2024, 1, 10, 4), numeric_value=10.0),
+            *[
+                MeasureDataModel(device_id=1, timestamp=datetime(2024, 1, 20, hour), numeric_value=hour)
+                for hour in range(4, 8)
+            ],
+        ])
+        await session.commit()
+
+        history = await get_device_history_values(
+            session, 1, DeviceDataGroupBy.DAY, datetime(2024, 1, 1), DeviceHistoryStatistic.MEDIAN,
+        )
+
+    assert loaded == [(datetime(2024, 1, 1), datetime(2024, 1, 15, 23, 59, 59, 999999))]
+    assert history[9] == {"timestamp": "10", "value": "2.5"}
+    assert history[19] == {"timestamp": "20", "value": "5.5"}
+    assert history[0] == {"timestamp": "1", "value": None}
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+import engines.ingest
+from engines.ingest import IngestBuffer, IngestBufferFull
+
+
+class SavedBatches(list):
+    """Batches written by the buffer, failing the first `failures` writes"""
+
+    failures = 0
+
+    async def save_measure_data(self, session, rows):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database is down")
+        self.append(list(rows))
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    saved_batches = SavedBatches()
+    monkeypatch.setattr(engines.ingest, "save_measure_data", saved_batches.save_measure_data)
+    return saved_batches
+
+
+def make_buffer(max_size: int = 100, flush_size: int = 3, max_retries: int = 2) -> IngestBuffer:
+    return IngestBuffer(
+        max_retries=max_retries,
+        retry_backoff=0,
+        max_size=max_size,
+        flush_size=flush_size,
+        flush_interval=0.01,
+    )
+
+
+async def test_rows_are_flushed_in_batches_of_flush_size(saved, make_row):
+    buffer = make_buffer(flush_size=3)
+
+    await buffer.start()
+    for device_id in range(7):
+        await buffer.put(make_row(device_id))
+    await asyncio.sleep(0.05)
+    await buffer.stop()
+
+    assert [len(batch) for batch in saved] == [3, 3, 1]
+
+
+async def test_put_nowait_raises_when_full(saved, make_row):
+    buffer = make_buffer(max_size=1)
+
+    await buffer.start()
+    buffer.put_nowait(make_row())
+    with pytest.raises(IngestBufferFull):
+        buffer.put_nowait(make_row())
+    await buffer.stop()
+
+
+def test_put_requires_a_running_buffer(saved, make_row):
+    with pytest.raises(RuntimeError):
+        make_buffer().put_nowait(make_row())
+
+
+async def test_failed_flush_is_retried(saved, make_row):
+    saved.failures = 2
+    buffer = make_buffer(max_retries=2)
+
+    await buffer.start()
+    await buffer.put(make_row())
+    await asyncio.sleep(0.05)
+    await buffer.stop()
+
+    assert len(saved) == 1
+    assert buffer.dropped == 0
+
+
+async def test_rows_are_dropped_after_the_last_retry(saved, make_row):
+    saved.failures = 3
+    buffer = make_buffer(max_retries=2)
+
+    await buffer.start()
+    await buffer.put(make_row())
+    await asyncio.sleep(0.05)
+    await buffer.stop()
+
+    assert saved == []
+    assert buffer.dropped == 1
+
+
+async def test_stop_flushes_pending_rows(saved, make_row):
+    buffer = make_buffer(flush_size=100)
+    buffer.flush_interval = 60
+
+    await buffer.start()
+    await buffer.put(make_row(1))
+    await buffer.put(make_row(2))
+    await asyncio.sleep(0)
+    await buffer.stop()
+
+    assert [[row["device_id"] for row in batch] for batch in saved] == [[1, 2]]
@@ -0,0 +1,60 @@
+import pytest
+
+import controllers.gardens
+import engines.lightbulbs
+from engines.mqtt import MQTTPublisher
+from engines.pubsub import pubsub_hub
+from models import DeviceModel
+
+
+@pytest.fixture
+def publisher(monkeypatch):
+    publisher = MQTTPublisher(
+        queue_size=1, broker_url="mqtt://localhost", reconnect_interval=0, max_reconnect_interval=0,
+    )
+    monkeypatch.setattr(engines.lightbulbs, "mqtt_publisher", publisher)
+    return publisher
+
+
+def get_commands(publisher: MQTTPublisher) -> list[list[tuple[str, str]]]:
+    return [list(command) for command in publisher._queue._queue]
+
+
+async def get_light_turned_on(db, device_id: int) -> bool:
+    async with db() as session:
+        return (await session.get(DeviceModel, device_id)).light_turned_on
+
+
+async def test_trigger_stores_notifies_and_publishes_the_state(client, db, publisher):
+    with pubsub_hub.subscribe(1) as subscription:
+        response = client.post("/devices/2/trigger", json={"action": "turn_on"})
+
+        assert response.status_code == 200
+        assert await get_light_turned_on(db, 2) is True
+        assert await subscription.get() == {"type": "lightbulb", "device_id": 2, "light_turned_on": True}
+        assert get_commands(publisher) == [[("hust-iot-lightbulbs/2", "1")]]
+
+
+async def test_busy_publisher_leaves_the_state_untouched(client, db, publisher):
+    publisher.publish("lightbulbs/1", "1")
+
+    response = client.post("/devices/2/trigger", json={"action": "turn_on"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert await get_light_turned_on(db, 2) is False
+
+
+def test_garden_trigger_sends_one_command_for_all_its_lightbulbs(client, publisher, monkeypatch):
+    async def set_garden_lightbulbs_state(session, garden_id, light_turned_on, device_ids=None):
+        return [2, 3]
+
+    monkeypatch.setattr(controllers.gardens, "set_garden_lightbulbs_state", set_garden_lightbulbs_state)
+
+    response = client.post("/gardens/1/lightbulbs/trigger", json={"action": "turn_off"})
+
+    assert response.json() == [
+        {"device_id": 2, "light_turned_on": False},
+        {"device_id": 3, "light_turned_on": False},
+    ]
+    assert get_commands(publisher) == [[("hust-iot-lightbulbs/2", "0"), ("hust-iot-lightbulbs/3", "0")]]
@@ -0,0 +1,44 @@
+import pytest
+
+import controllers.measure_data
+from engines.device_tokens import device_token_issuer
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    saved_rows = []
+
+    async def save_measure_data(session, rows):
+        saved_rows.extend(rows)
+
+    monkeypatch.setattr(controllers.measure_data, "save_measure_data", save_measure_data)
+    return saved_rows
+
+
+def test_each_item_gets_its_own_result(client, saved):
+    response = client.post("/measure-data/batch", json={"items": [
+        {"access_token": device_token_issuer.issue(1), "value": "21.5"},
+        {"access_token": "not a token", "value": "22"},
+        {"access_token": device_token_issuer.issue(99), "value": "23"},
+        {"access_token": device_token_issuer.issue(1), "value": "24", "timestamp": "2024-01-15T12:00:00"},
+    ]})
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "received": 2,
+        "failed": 2,
+        "items": [
+            {"index": 0, "success": True, "detail": "Data received successfully"},
+            {"index": 1, "success": False, "detail": "Invalid access token"},
+            {"index": 2, "success": False, "detail": "Device not found"},
+            {"index": 3, "success": True, "detail": "Data received successfully"},
+        ],
+    }
+    assert [(row["device_id"], row["value"]) for row in saved] == [(1, "21.5"), (1, "24")]
+
+
+def test_empty_batches_are_rejected(client, saved):
+    response = client.post("/measure-data/batch", json={"items": []})
+
+    assert response.status_code == 422
+    assert saved == []
@@ -0,0 +1,49 @@
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+
+from engines.metrics import Counter, Gauge, Histogram, MetricsMiddleware, MetricsRegistry, request_duration
+
+
+def test_metrics_are_rendered_in_the_prometheus_text_format():
+    registry = MetricsRegistry()
+    registry.register(Counter("jobs_total", "Jobs run", ("queue",))).inc('say "hi"\n')
+    registry.register(Histogram("job_seconds", "Job duration", buckets=(0.1, 1))).observe(0.5)
+    registry.register(Gauge("jobs_queued", "Jobs waiting", read=lambda: [((), 3)]))
+
+    assert registry.render().splitlines() == [
+        "# HELP jobs_total Jobs run",
+        "# TYPE jobs_total counter",
+        'jobs_total{queue="say \\"hi\\"\\n"} 1',
+        "# HELP job_seconds Job duration",
+        "# TYPE job_seconds histogram",
+        'job_seconds_bucket{le="0.1"} 0',
+        'job_seconds_bucket{le="1"} 1',
+        'job_seconds_bucket{le="+Inf"} 1',
+        "job_seconds_sum 0.5",
+        "job_seconds_count 1",
+        "# HELP jobs_queued Jobs waiting",
+        "# TYPE jobs_queued gauge",
+        "jobs_queued 3",
+    ]
+
+
+def test_requests_are_recorded_by_route_template():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int):
+        return {"id": item_id}
+
+    TestClient(app).get("/items/1")
+    TestClient(app).get("/items/2")
+
+    _, (_, count) = request_duration._values[("GET", "/items/{item_id}", 200)]
+    assert count == 2
+
+
+def test_metrics_endpoint(client):
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
@@ -0,0 +1,108 @@
+import pytest
+from asyncio_mqtt import MqttError
+
+from engines.mqtt import MQTTPublisher, MQTTPublisherBusy
+
+
+class FakeClient:
+    """Stands in for asyncio_mqtt.Client, failing the first `failures` publishes"""
+
+    def __init__(self, failures: int = 0, error: Exception = MqttError("connection lost")):
+        self.failures = failures
+        self.error = error
+        self.published = []
+
+    def __call__(self, **kwargs):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def publish(self, topic, payload):
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        self.published.append((topic, payload))
+
+
+def make_publisher(client: FakeClient, queue_size: int = 2) -> MQTTPublisher:
+    return MQTTPublisher(
+        queue_size=queue_size,
+        broker_url="mqtt://localhost",
+        reconnect_interval=0,
+        max_reconnect_interval=0,
+        client_factory=client,
+    )
+
+
+def test_publish_raises_busy_when_queue_is_full():
+    publisher = make_publisher(FakeClient(), queue_size=2)
+
+    publisher.publish("lightbulbs/1", "1")
+    publisher.publish("lightbulbs/2", "1")
+
+    assert publisher.full
+    with pytest.raises(MQTTPublisherBusy):
+        publisher.publish("lightbulbs/3", "1")
+    assert publisher.queued == 2
+
+
+def test_burst_takes_one_slot_however_large():
+    publisher = make_publisher(FakeClient(), queue_size=1)
+
+    publisher.publish_many([(f"lightbulbs/{device_id}", "0") for device_id in range(5000)])
+
+    assert publisher.queued == 5000
+    with pytest.raises(MQTTPublisherBusy):
+        publisher.publish("lightbulbs/1", "1")
+
+
+def test_reserve_fails_before_entering_when_full():
+    publisher = make_publisher(FakeClient(), queue_size=1)
+    publisher.publish("lightbulbs/1", "1")
+
+    entered = False
+    with pytest.raises(MQTTPublisherBusy):
+        with publisher.reserve():
+            entered = True
+
+    assert not entered
+
+
+def test_reserved_slot_is_not_taken_by_others():
+    publisher = make_publisher(FakeClient(), queue_size=1)
+
+    with publisher.reserve() as publish_command:
+        with pytest.raises(MQTTPublisherBusy):
+            publisher.publish("lightbulbs/2", "1")
+        publish_command([("lightbulbs/1", "1")])
+
+    assert publisher.queued == 1
+    assert publisher.full
+
+
+async def test_messages_are_published_in_order_and_retried_after_reconnecting():
+    client = FakeClient(failures=1)
+    publisher = make_publisher(client, queue_size=10)
+
+    publisher.publish_many([("lightbulbs/1", "1"), ("lightbulbs/2", "1")])
+    publisher.publish("lightbulbs/3", "0")
+    await publisher.start()
+    await publisher.stop()
+
+    assert client.published == [("lightbulbs/1", "1"), ("lightbulbs/2", "1"), ("lightbulbs/3", "0")]
+    assert publisher.queued == 0
+
+
+async def test_unexpected_client_errors_reconnect_instead_of_ending_the_task():
+    client = FakeClient(failures=1, error=AttributeError("message_retry_set"))
+    publisher = make_publisher(client, queue_size=10)
+
+    publisher.publish("lightbulbs/1", "1")
+    await publisher.start()
+    await publisher.stop()
+
+    assert client.published == [("lightbulbs/1", "1")]
@@ -0,0 +1,43 @@
+import pytest
+from fastapi import HTTPException
+
+from engines.pagination import InvalidCursor, decode_cursor, encode_cursor, get_page, get_page_params
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(42)) == 42
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "bm90IGpzb24=", encode_cursor("42"), "eyJpZCI6IG51bGx9", "e30="])
+def test_invalid_cursors_are_rejected(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def test_page_params_reject_invalid_cursors_with_400():
+    with pytest.raises(HTTPException) as error:
+        get_page_params(cursor="not base64!", limit=10)
+
+    assert error.value.status_code == 400
+
+
+def test_page_params_decode_the_cursor():
+    page = get_page_params(cursor=encode_cursor(7), limit=10)
+
+    assert page.after_id == 7
+    assert page.limit == 10
+
+
+def test_last_page_has_no_next_cursor():
+    rows, next_cursor = get_page([(1,), (2,)], limit=2)
+
+    assert rows == [(1,), (2,)]
+    assert next_cursor is None
+
+
+def test_next_cursor_points_at_the_last_row_of_the_page():
+    # Pages are fetched with one extra row to tell whether there is a next page
+    rows, next_cursor = get_page([(1,), (2,), (3,)], limit=2)
+
+    assert rows == [(1,), (2,)]
+    assert decode_cursor(next_cursor) == 2
@@ -0,0 +1,57 @@
+from engines.pubsub import PubSubHub, stream_garden_events
+
+
+def drain(subscription) -> list[dict]:
+    events = []
+    while not subscription._queue.empty():
+        events.append(subscription._queue.get_nowait())
+    return events
+
+
+def test_events_reach_every_subscriber_of_their_garden_only():
+    hub = PubSubHub(queue_size=10)
+
+    with hub.subscribe(1) as first, hub.subscribe(1) as second, hub.subscribe(2) as other:
+        hub.publish(1, {"type": "lightbulb", "device_id": 1})
+
+        assert drain(first) == drain(second) == [{"type": "lightbulb", "device_id": 1}]
+        assert drain(other) == []
+
+
+async def test_slow_subscribers_drop_their_oldest_events():
+    hub = PubSubHub(queue_size=2)
+
+    with hub.subscribe(1) as slow, hub.subscribe(1) as fast:
+        for device_id in range(3):
+            hub.publish(1, {"type": "lightbulb", "device_id": device_id})
+            if device_id < 2:
+                await fast.get()
+
+        assert [event["device_id"] for event in drain(slow)] == [1, 2]
+        assert slow.dropped == 1
+        assert [event["device_id"] for event in drain(fast)] == [2]
+        assert fast.dropped == 0
+
+
+def test_subscriptions_end_with_their_context():
+    hub = PubSubHub(queue_size=2)
+
+    with hub.subscribe(1):
+        assert hub.subscribers == 1
+
+    assert hub.subscribers == 0
+    # Nothing left to deliver to
+    hub.publish(1, {"type": "lightbulb", "device_id": 1})
+
+
+async def test_garden_events_are_streamed_as_server_sent_events(monkeypatch):
+    hub = PubSubHub(queue_size=2)
+    monkeypatch.setattr("engines.pubsub.pubsub_hub", hub)
+    stream = stream_garden_events(1, keepalive_interval=0.01)
+
+    assert await anext(stream) == ": keepalive\n\n"
+    hub.publish(1, {"type": "lightbulb", "device_id": 1})
+    assert await anext(stream) == 'event: lightbulb\ndata: {"type": "lightbulb", "device_id": 1}\n\n'
+
+    await stream.aclose()
+    assert hub.subscribers == 0
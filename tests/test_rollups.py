@@ -0,0 +1,68 @@
+from datetime import datetime
+
+import engines.rollups
+from engines.rollups import aggregate_rollups, get_bucket, rebuild_rollups
+from enums import DeviceDataGroupBy
+from models import MeasureDataModel
+
+
+def test_buckets_start_the_hour_day_and_month():
+    timestamp = datetime(2024, 2, 15, 13, 45, 30, 123)
+
+    assert get_bucket(DeviceDataGroupBy.HOUR, timestamp) == datetime(2024, 2, 15, 13)
+    assert get_bucket(DeviceDataGroupBy.DAY, timestamp) == datetime(2024, 2, 15)
+    assert get_bucket(DeviceDataGroupBy.MONTH, timestamp) == datetime(2024, 2, 1)
+
+
+def test_rows_are_folded_into_every_granularity(make_row):
+    rollups = aggregate_rollups([
+        make_row(timestamp=datetime(2024, 2, 15, 13, 5), numeric_value=20.0),
+        make_row(timestamp=datetime(2024, 2, 15, 13, 35), numeric_value=24.0),
+        make_row(timestamp=datetime(2024, 2, 15, 14, 5), numeric_value=18.0),
+    ])
+
+    assert rollups[(1, DeviceDataGroupBy.HOUR, datetime(2024, 2, 15, 13))] == [2, 44.0, 20.0, 24.0]
+    assert rollups[(1, DeviceDataGroupBy.HOUR, datetime(2024, 2, 15, 14))] == [1, 18.0, 18.0, 18.0]
+    assert rollups[(1, DeviceDataGroupBy.DAY, datetime(2024, 2, 15))] == [3, 62.0, 18.0, 24.0]
+    assert rollups[(1, DeviceDataGroupBy.MONTH, datetime(2024, 2, 1))] == [3, 62.0, 18.0, 24.0]
+
+
+def test_non_numeric_rows_are_skipped(make_row):
+    rollups = aggregate_rollups([make_row(value="on", numeric_value=None)])
+
+    assert rollups == {}
+
+
+def test_rows_are_added_to_existing_rollups(make_row):
+    rollups = aggregate_rollups([make_row(timestamp=datetime(2024, 2, 15, 13), numeric_value=20.0)])
+    aggregate_rollups([make_row(timestamp=datetime(2024, 2, 15, 13, 30), numeric_value=30.0)], rollups)
+
+    assert rollups[(1, DeviceDataGroupBy.HOUR, datetime(2024, 2, 15, 13))] == [2, 50.0, 20.0, 30.0]
+
+
+async def test_rebuild_merges_the_buckets_ingest_still_writes_to(db, monkeypatch):
+    calls = []
+
+    async def rollup_raw_data(session, granularity, start, end=None, device_id=None, merge=False):
+        calls.append((granularity, start, end, merge))
+
+    async def rollup_daily_rollups(session, start, end=None, device_id=None, merge=False):
+        calls.append((DeviceDataGroupBy.MONTH, start, end, merge))
+
+    monkeypatch.setattr(engines.rollups, "_rollup_raw_data", rollup_raw_data)
+    monkeypatch.setattr(engines.rollups, "_rollup_daily_rollups", rollup_daily_rollups)
+
+    async with db() as session:
+        session.add(MeasureDataModel(device_id=1, timestamp=datetime(2024, 1, 20, 8), numeric_value=21.5))
+        await session.commit()
+
+        await rebuild_rollups(session, now=datetime(2024, 3, 10, 15))
+
+    assert calls == [
+        (DeviceDataGroupBy.HOUR, datetime(2024, 1, 20), datetime(2024, 3, 10), False),
+        (DeviceDataGroupBy.HOUR, datetime(2024, 3, 10), None, True),
+        (DeviceDataGroupBy.DAY, datetime(2024, 1, 20), datetime(2024, 3, 10), False),
+        (DeviceDataGroupBy.DAY, datetime(2024, 3, 10), None, True),
+        (DeviceDataGroupBy.MONTH, datetime(2024, 1, 1), datetime(2024, 3, 1), False),
+        (DeviceDataGroupBy.MONTH, datetime(2024, 3, 1), None, True),
+    ]